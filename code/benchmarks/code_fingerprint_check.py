@@ -0,0 +1,56 @@
+"""
+Regression check of `promptings.EvaluationMemo.code_fingerprint`.
+
+Candidates that differ only in formatting must share a fingerprint, so
+the memo skips re-running them; candidates that can behave differently
+(e.g. a changed string literal) must not, or the memo would hand one the
+sample-IO result of the other.
+
+    python benchmarks/code_fingerprint_check.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from promptings.EvaluationMemo import code_fingerprint
+
+
+SAME = [
+    (
+        "C++",
+        '#include <iostream>\nint main() {\n    int a, b;\n    std::cin >> a >> b;\n    std::cout << a + b;\n}\n',
+        '#include <iostream>\n\nint main() {\n\tint a, b;   \n\tstd::cin >> a >> b;\n\n\tstd::cout << a + b;\n}',
+    ),
+    (
+        "Python3",
+        "a, b = map(int, input().split())\nprint(a + b)  # sum\n",
+        "a,b=map(int,input().split())\n\nprint( a+b )\n",
+    ),
+    (
+        "Java",
+        "class Main {\n  public static void main(String[] args) {\n    System.out.println(1);\n  }\n}",
+        "class Main {\n        public static void main(String[] args) {\n                System.out.println(1);   \n        }\n}\n\n",
+    ),
+]
+
+DIFFERENT = [
+    ("C++", 'cout << a << " " << b;', 'cout << a << "" << b;'),
+    ("C++", 'printf("%d %d\\n", a, b);', 'printf("%d%d\\n", a, b);'),
+    ("Java", 'System.out.print(a + " " + b);', 'System.out.print(a + "" + b);'),
+    ("Python3", 'print(a, b, sep=" ")', 'print(a, b, sep="")'),
+    # Does not parse, so it takes the textual path
+    ("Python3", 'print(a, " ", b\n', 'print(a, "", b\n'),
+]
+
+
+def main():
+    for language, left, right in SAME:
+        assert code_fingerprint(left, language) == code_fingerprint(right, language), (language, left, right)
+    for language, left, right in DIFFERENT:
+        assert code_fingerprint(left, language) != code_fingerprint(right, language), (language, left, right)
+    print(f"{len(SAME)} formatting-only pairs share a fingerprint, {len(DIFFERENT)} distinct pairs do not")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-item logging overhead of the old `print(..., flush=True)` of every
+prompt and response against `EventLogger`, with and without bodies.
+
+An item is simulated by the texts a pass logs: the retrieval prompt and
+response, k planning and verification exchanges, the coding exchange and
+`t` debugging rounds. Output goes to a file in a temporary directory.
+Two times are reported per item: the time spent in the solving threads,
+and the total until everything is written (for `EventLogger`, including
+the background writer draining its queue). Prompt and response events are
+DEBUG, so the default INFO level drops them; compare DEBUG with print,
+which writes the same events.
+
+    python benchmarks/event_log_overhead.py --items 200 --concurrency 8
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils.event_log import EventLogger, correlation_id
+
+
+def item_texts(k: int, t: int, prompt_chars: int, response_chars: int) -> list:
+    exchanges = 1 + 2 * k + 1 + t
+    return [("x" * prompt_chars, "y" * response_chars)] * exchanges
+
+
+def run_print(path: str, items: int, concurrency: int, texts: list) -> tuple:
+    with open(path, "w", encoding="utf-8") as fp:
+        def solve(task_id):
+            for prompt, response in texts:
+                print("\n\n________________________", file=fp)
+                print(f"Input for stage ({task_id}):", file=fp)
+                print(prompt, flush=True, file=fp)
+                print(f"Response from stage ({task_id}):", file=fp)
+                print(response, flush=True, file=fp)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(solve, range(items)))
+        elapsed = time.perf_counter() - started
+        return elapsed, elapsed
+
+
+def run_events(path: str, items: int, concurrency: int, texts: list, level: int, log_prompts: bool) -> tuple:
+    log = EventLogger(path, level=level, log_prompts=log_prompts)
+
+    def solve(task_id):
+        correlation_id.set(str(task_id))
+        for stage_no, (prompt, response) in enumerate(texts):
+            log.text("llm.prompt", prompt, stage=stage_no)
+            log.text("llm.response", response, stage=stage_no)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(solve, range(items)))
+    submitted = time.perf_counter() - started
+    log.close()
+    return submitted, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("-t", type=int, default=5)
+    parser.add_argument("--prompt-chars", type=int, default=8000)
+    parser.add_argument("--response-chars", type=int, default=2000)
+    args = parser.parse_args()
+
+    texts = item_texts(args.k, args.t, args.prompt_chars, args.response_chars)
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = [
+            ("print(flush=True)", run_print(os.path.join(tmp, "print.log"), args.items, args.concurrency, texts)),
+            ("events INFO", run_events(os.path.join(tmp, "info.jsonl"), args.items, args.concurrency, texts, logging.INFO, False)),
+            ("events DEBUG", run_events(os.path.join(tmp, "debug.jsonl"), args.items, args.concurrency, texts, logging.DEBUG, False)),
+            ("events + bodies", run_events(os.path.join(tmp, "bodies.jsonl"), args.items, args.concurrency, texts, logging.DEBUG, True)),
+        ]
+
+    print(f"{'sink':<18} {'caller us/item':>15} {'total us/item':>15}")
+    for name, (submitted, total) in rows:
+        print(f"{name:<18} {submitted / args.items * 1e6:>15.1f} {total / args.items * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+ElementTree parse of model responses as done before `utils.parse_tags`,
+kept as the baseline of the parse_tags fuzz run and benchmark.
+"""
+import xml.etree.ElementTree as ET
+
+
+RETRIEVAL_TAGS = ("algorithm", "description", "code", "planning", "techniques", "learned_techniques")
+VERIFICATION_TAGS = ("analysis", "confidence")
+
+
+def replace_tag(text: str, tag: str):
+    if f'<{tag}><![CDATA[' in text and f']]></{tag}>' in text:
+        return text
+    else:
+        return text.replace(f'<{tag}>', f'<{tag}><![CDATA[').replace(f'</{tag}>', f']]></{tag}>').strip()
+
+
+def xml_to_dict(element):
+    result = {}
+    for child in element:
+        if child:
+            child_data = xml_to_dict(child)
+            if child.tag in result:
+                if isinstance(result[child.tag], list):
+                    result[child.tag].append(child_data)
+                else:
+                    result[child.tag] = [result[child.tag], child_data]
+            else:
+                result[child.tag] = child_data
+        else:
+            result[child.tag] = child.text
+    return result
+
+
+def legacy_parse(response: str, tags=RETRIEVAL_TAGS) -> dict:
+    """CDATA rewrites, fence stripping and up to three ElementTree attempts"""
+    for tag in tags:
+        response = replace_tag(response, tag)
+
+    if '```xml' in response:
+        response = response.replace('```xml', '')
+    if '```' in response:
+        response = response.replace('```', '')
+
+    try:
+        root = ET.fromstring(response)
+    except ET.ParseError:
+        try:
+            root = ET.fromstring('<root>\n' + response + '\n</root>')
+        except ET.ParseError:
+            root = ET.fromstring('<root>\n' + response)
+
+    return xml_to_dict(root)
+
+
+def tags_for(name: str):
+    """Tags rewritten for a corpus file, by its name prefix"""
+    return VERIFICATION_TAGS if name.startswith("verification") else RETRIEVAL_TAGS
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of `utils.parse_tags` against the former CDATA rewrite +
+ElementTree path, on the corpus responses the former path can parse and
+on long retrieval responses with many exemplars.
+
+    python benchmarks/parse_tags_bench.py --repeat 2000
+"""
+import os
+import re
+import sys
+import timeit
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from utils.parse_tags import parse_tags
+from legacy_xml import legacy_parse, tags_for
+from parse_tags_fuzz import load_corpus
+
+
+def long_retrieval(text: str, problems: int) -> str:
+    """The well-formed retrieval response with its problems repeated"""
+    blocks = re.findall(r"<problem>.*?</problem>\n", text, re.DOTALL)
+    body = "".join(blocks[i % len(blocks)] for i in range(problems))
+    start, end = text.index("<problem>"), text.rindex("</problem>\n") + len("</problem>\n")
+    return text[:start] + body + text[end:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    cases = []
+    for name, text in corpus.items():
+        try:
+            legacy_parse(text, tags_for(name))
+        except Exception:
+            continue
+        cases.append((name, text, tags_for(name)))
+    for problems in (10, 50):
+        text = long_retrieval(corpus["retrieval_wellformed.txt"], problems)
+        cases.append((f"retrieval x{problems} problems", text, tags_for("retrieval")))
+
+    print(f"{'response':<28} {'chars':>7} {'former us':>10} {'parse_tags us':>14} {'speedup':>8}")
+    for name, text, tags in cases:
+        repeat = max(1, args.repeat * 2000 // max(len(text), 2000))
+        former = timeit.timeit(lambda: legacy_parse(text, tags), number=repeat) / repeat
+        single = timeit.timeit(lambda: parse_tags(text), number=repeat) / repeat
+        print(f"{name:<28} {len(text):>7} {former * 1e6:>10.1f} {single * 1e6:>14.1f} {former / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Fuzz run of `utils.parse_tags` over the response corpus.
+
+Every corpus file the former ElementTree path can parse must give the
+same dict through `parse_tags`. Then randomly corrupted copies of the
+corpus (truncations, deleted spans, stray tags, `<`, `&`, fences and CDATA
+markers) must parse without raising into the documented shape. The share
+of corrupted responses the former path rejects is reported as the
+re-queries it would have cost.
+
+    python benchmarks/parse_tags_fuzz.py --iterations 20000 --seed 0
+"""
+import os
+import sys
+import random
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+from utils.parse_tags import parse_tags
+from legacy_xml import legacy_parse, tags_for
+
+
+CORPUS = os.path.join(HERE, "corpus", "parse_tags")
+
+FRAGMENTS = [
+    "<", "<<", "a < b", "&", "&&", "</", ">", "<root>", "</root>", "<problem>", "</problem>",
+    "<code>", "</code>", "<planning>", "</description>", "<analysis>", "</confidence>",
+    "<![CDATA[", "]]>", "```", "```xml\n", "```python\n", "<b>", "</i>", "\n\n",
+]
+
+
+def load_corpus() -> dict:
+    corpus = {}
+    for name in sorted(os.listdir(CORPUS)):
+        with open(os.path.join(CORPUS, name), encoding="utf-8") as fp:
+            corpus[name] = fp.read()
+    return corpus
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    for _ in range(rng.randint(1, 4)):
+        position = rng.randint(0, len(text))
+        kind = rng.randrange(4)
+        if kind == 0:
+            text = text[:position]
+        elif kind == 1:
+            text = text[:position] + text[position + rng.randint(1, 40):]
+        elif kind == 2:
+            text = text[:position] + rng.choice(FRAGMENTS) + text[position:]
+        else:
+            end = min(len(text), position + rng.randint(1, 200))
+            text = text[:end] + text[position:end] + text[end:]
+    return text
+
+
+def check_shape(result: dict):
+    assert isinstance(result, dict)
+    for key, value in result.items():
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            if key == "problem":
+                assert isinstance(value, dict), value
+                assert all(isinstance(v, (str, list)) for v in value.values()), value
+            else:
+                assert isinstance(value, str), value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    for name, text in corpus.items():
+        result = parse_tags(text)
+        check_shape(result)
+        try:
+            expected = legacy_parse(text, tags_for(name))
+        except Exception as e:
+            print(f"{name:<28} former path fails ({type(e).__name__})")
+            continue
+        assert result == expected, f"{name}: {result!r} != {expected!r}"
+        print(f"{name:<28} matches the former path")
+
+    rng = random.Random(args.seed)
+    names = list(corpus)
+    legacy_failures = 0
+    for _ in range(args.iterations):
+        name = rng.choice(names)
+        text = mutate(rng, corpus[name])
+        check_shape(parse_tags(text))
+        try:
+            legacy_parse(text, tags_for(name))
+        except Exception:
+            legacy_failures += 1
+
+    print(
+        f"{args.iterations} corrupted responses: parse_tags raised 0, "
+        f"former path failed {legacy_failures} ({legacy_failures / args.iterations:.1%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+End-to-end benchmark of `Blueprint2Code.run_single_pass` on a replayed
+transcript, so pipeline overhead (parsing, evaluation, scheduling,
+logging) is measured without a paid API.
+
+A scripted model answers every stage of a synthetic dataset once while
+`TranscriptRecorder` records it; the items are then solved again through
+`ReplayModel` at every requested concurrency. Each item needs retrieval,
+k planning/verification chains, one coding call and one debugging round.
+Reported per concurrency: items/sec and CPU milliseconds per item for
+every span (stage, model call, sample-IO evaluation).
+
+    python benchmarks/replay_pipeline.py --items 128 --concurrency 1 8 64 --latency 0.05
+"""
+import os
+import re
+import sys
+import copy
+import time
+import logging
+import argparse
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from models.Base import BaseModel
+from models.Replay import ReplayModel, TranscriptRecorder
+from promptings.Blueprint2Code import Blueprint2Code
+from utils.event_log import EventLogger
+from utils.instrumentation import SpanRecorder
+
+
+WRONG = "a, b = map(int, input().split())\nprint(a - b)"
+SOLUTION = "a, b = map(int, input().split())\nprint(a + b)"
+
+
+class SyntheticData(object):
+    def __init__(self, size: int):
+        self.data = [
+            {
+                "task_id": f"ITEM-{i}",
+                "description": (
+                    f"Problem ITEM-{i}\n\nRead two integers a and b from one line and print their sum.\n\n"
+                    + "Constraints: -10^9 <= a, b <= 10^9. " * 20
+                ),
+                "sample_io": [{"input": f"{i} {j}", "output": [str(i + j)]} for j in range(3)],
+            }
+            for i in range(size)
+        ]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get_prompt(self, item: dict) -> str:
+        return item["description"]
+
+    def evaluate_sample_io(self, item: dict, code: str, language: str):
+        if code.strip() == SOLUTION:
+            return True, "".join(f"passed in test case: {io['input']}\n" for io in item["sample_io"])
+        io = item["sample_io"][0]
+        return False, f"failed in test case: {io['input']}\nexpected output: {io['output'][0]}\nyour output: 0\n"
+
+    def evaluate(self, item: dict, cur_imp: str, language: str) -> bool:
+        return cur_imp.strip() == SOLUTION
+
+
+class ScriptedModel(BaseModel):
+    """Answers every Blueprint2Code stage from the content of its prompt"""
+
+    model_params = {"model": "scripted"}
+
+    def __init__(self, k: int):
+        self.k = k
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        content = processed_input[-1]["content"]
+        if "provide relevant problems" in content:
+            item = re.search(r"Problem (ITEM-\d+)", content).group(1)
+            problems = "".join(
+                f"<problem>\n<description>\nExemplar {j} related to {item}: add numbers read from stdin.\n</description>\n"
+                f"<code>\n{SOLUTION}\n</code>\n<techniques>\nParse a line with map(int, split()).\n</techniques>\n"
+                f"<planning>\n1. Read the line.\n2. Convert and add.\n3. Print.\n</planning>\n</problem>\n"
+                for j in range(self.k)
+            )
+            response = (
+                f"<root>\n{problems}<algorithm>\nArithmetic on parsed input; mind a < 0 and b < 0.\n</algorithm>\n"
+                f"<learned_techniques>\nmap(int, input().split())\n</learned_techniques>\n</root>"
+            )
+        elif "Evaluate the following plan" in content:
+            plan = int(re.search(r"PLAN-(\d+)", content).group(1))
+            response = f"<root>\n<analysis>\nThe plan reads both values and sums them.\n</analysis>\n<confidence>\n{90 - 10 * plan}\n</confidence>\n</root>"
+        elif "generate a detailed, step-by-step plan" in content:
+            plan = int(re.search(r"Exemplar (\d+)", content).group(1))
+            response = f"PLAN-{plan}\n" + "".join(f"{step}. Step {step} of the plan.\n" for step in range(1, 9))
+        elif "code to solve the problem above based on the provided plan" in content:
+            response = f"```python\n{WRONG}\n```"
+        else:
+            response = f"The sign was wrong.\n```python\n{SOLUTION}\n```"
+        return response, len(content.split()), len(response.split())
+
+
+def make_strategy(model, data, instrumentation=None, **kwargs):
+    return Blueprint2Code(
+        model=model,
+        data=data,
+        language="Python3",
+        pass_at_k=1,
+        results=None,
+        verbose=False,
+        event_logger=EventLogger(level=logging.WARNING),
+        instrumentation=instrumentation,
+        **kwargs
+    )
+
+
+def solve(strategy, items: list, concurrency: int) -> float:
+    items = copy.deepcopy(items)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(strategy.run_single_pass, items))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean replay latency per call, seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--sandbox", action="store_true", help="run sample IO in utils.sandbox.SandboxPool")
+    args = parser.parse_args()
+
+    data = SyntheticData(args.items)
+    evaluator = None
+    if args.sandbox:
+        from utils.sandbox import SandboxPool
+        evaluator = SandboxPool()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        transcript = os.path.join(tmp, "transcript.jsonl")
+        recorder = TranscriptRecorder(ScriptedModel(args.k), transcript)
+        solve(make_strategy(recorder, data, k=args.k, t=2, sample_io_evaluator=evaluator), data.data, 1)
+        recorder.close()
+
+        for concurrency in args.concurrency:
+            spans = SpanRecorder()
+            model = ReplayModel(transcript, latency=args.latency, latency_sigma=args.latency_sigma)
+            strategy = make_strategy(model, data, spans, k=args.k, t=2, sample_io_evaluator=evaluator)
+
+            cpu_started = time.process_time()
+            elapsed = solve(strategy, data.data, concurrency)
+            cpu = time.process_time() - cpu_started
+
+            print(
+                f"concurrency {concurrency}: {args.items / elapsed:.1f} items/s, "
+                f"process CPU {cpu / args.items * 1e3:.2f} ms/item"
+            )
+            for name, stats in sorted(spans.totals().items()):
+                print(
+                    f"  {name:<18} {int(stats['count']):>6} spans  "
+                    f"{stats['cpu_time'] / args.items * 1e3:>8.2f} ms CPU/item  "
+                    f"{stats['wall_time'] / args.items * 1e3:>9.2f} ms wall/item"
+                )
+
+    if evaluator is not None:
+        evaluator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Cost of `Results.add_result` as the result file grows, rewrite mode
+against append-only mode.
+
+    python benchmarks/results_log.py --items 5000 --window 500
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from results.Results import Results
+
+
+def make_result(task_id: int) -> dict:
+    return {
+        "task_id": task_id,
+        "source_codes": ["print(sum(map(int, input().split())))"],
+        "is_solved": task_id % 3 != 0,
+        "api_calls": 12,
+        "prompt_tokens": 18_000,
+        "completion_tokens": 2_400,
+    }
+
+
+def run(append_only: bool, items: int, window: int, flush_interval: int) -> list:
+    """Mean seconds per `add_result` for each `window` results added"""
+    with tempfile.TemporaryDirectory() as tmp:
+        results = Results(
+            os.path.join(tmp, "results.jsonl"),
+            append_only=append_only,
+            flush_interval=flush_interval,
+        )
+        timings = []
+        started = time.perf_counter()
+        for task_id in range(items):
+            results.add_result(make_result(task_id))
+            if (task_id + 1) % window == 0:
+                now = time.perf_counter()
+                timings.append((task_id + 1, (now - started) / window))
+                started = now
+        results.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=500)
+    parser.add_argument("--flush-interval", type=int, default=1)
+    args = parser.parse_args()
+
+    rewrite = run(False, args.items, args.window, args.flush_interval)
+    append = run(True, args.items, args.window, args.flush_interval)
+
+    print(f"{'results':>8} {'rewrite ms/add':>15} {'append ms/add':>14}")
+    for (size, slow), (_, fast) in zip(rewrite, append):
+        print(f"{size:>8} {slow * 1e3:>15.3f} {fast * 1e3:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
+import asyncio
+import contextvars
 import logging
 import sys
 
 import traceback
+from abc import abstractmethod
 
 
 
+# Details (queue time, retries, ...) of the latest model call made in the
+# current thread or asyncio task
+last_call = contextvars.ContextVar("last_call", default=None)
+
+# Stable key (e.g. the task id) of the item the current calls belong to;
+# routing models use it to pin an item's calls to one endpoint
+route_key = contextvars.ContextVar("route_key", default=None)
+
+
 class BaseModel():
     def __init__(self, **kwargs):
         pass
@@ -14,3 +26,36 @@ class BaseModel():
     def prompt(self, processed_input):
         pass
 
+    def prompt_choices(self, processed_input, n, **overrides):
+        # Models without an `n` parameter sample one request per choice, so
+        # the prompt tokens are counted once per request
+        results, calls = [], []
+        for _ in range(n):
+            results.append(self.prompt(processed_input, **overrides))
+            calls.append(last_call.get() or {})
+        last_call.set({
+            "queue_time": sum(call.get("queue_time", 0.0) for call in calls),
+            "retries": sum(call.get("retries", 0) for call in calls),
+            "cached_tokens": sum(call.get("cached_tokens", 0) for call in calls),
+            "requests": n,
+        })
+        return (
+            [result[0] for result in results],
+            sum(result[1] for result in results),
+            sum(result[2] for result in results),
+        )
+
+    async def aprompt(self, processed_input, **overrides):
+        # Models without a native async client run the blocking call on a thread
+        return await asyncio.to_thread(self.prompt, processed_input, **overrides)
+
+    @staticmethod
+    def last_call_info() -> dict:
+        return dict(last_call.get() or {})
+
+
+def prompt_choices(model, processed_input, n, **overrides):
+    """`model.prompt_choices`, or one `prompt` per choice for models without it"""
+    if hasattr(model, "prompt_choices"):
+        return model.prompt_choices(processed_input, n, **overrides)
+    return BaseModel.prompt_choices(model, processed_input, n, **overrides)
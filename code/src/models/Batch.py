@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+
+from models.Base import BaseModel, last_call, prompt_choices
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def request_key(body: dict) -> str:
+    payload = json.dumps(body, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class BatchBackend(ABC):
+    """
+    Submits a JSONL file of chat completion requests in the OpenAI batch
+    format and reports when the matching output file is ready. A batch id
+    must stay valid for `poll` in a later process.
+    """
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        pass
+
+    @abstractmethod
+    def poll(self, batch_id: str, output_path: str) -> bool:
+        """Writes the results to `output_path` and returns True once done"""
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as fp:
+            input_file = self.client.files.create(file=fp, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def poll(self, batch_id: str, output_path: str) -> bool:
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+        if batch.status != "completed":
+            return False
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.append(self.client.files.content(file_id).text.rstrip("\n"))
+        with open(output_path, "w", encoding="utf-8") as fp:
+            fp.write("\n".join(line for line in lines if line) + "\n")
+        return True
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch API. Each submitted file is answered
+    by `responder` (any BaseModel) on the first poll, which writes an
+    output file in the OpenAI batch format. The batch id is the input
+    path, so a batch can be polled again after a restart.
+    """
+
+    PREFIX = "batch_local:"
+
+    def __init__(self, responder: BaseModel):
+        self.responder = responder
+
+    def submit(self, input_path: str) -> str:
+        return self.PREFIX + os.path.abspath(input_path)
+
+    def poll(self, batch_id: str, output_path: str) -> bool:
+        input_path = batch_id[len(self.PREFIX):]
+        with open(input_path, encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+            for line in fin:
+                request = json.loads(line)
+                body = dict(request["body"])
+                messages = body.pop("messages")
+                body.pop("model", None)
+                n = body.pop("n", None)
+                try:
+                    if n is None:
+                        content, prompt_tokens, completion_tokens = self.responder.prompt(messages, **body)
+                        contents = [content]
+                    else:
+                        contents, prompt_tokens, completion_tokens = prompt_choices(self.responder, messages, n, **body)
+                    result = {
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {
+                                "choices": [
+                                    {"index": index, "message": {"role": "assistant", "content": content}}
+                                    for index, content in enumerate(contents)
+                                ],
+                                "usage": {
+                                    "prompt_tokens": prompt_tokens,
+                                    "completion_tokens": completion_tokens,
+                                    "total_tokens": prompt_tokens + completion_tokens,
+                                },
+                            },
+                        },
+                        "error": None,
+                    }
+                except Exception as e:
+                    result = {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+                fout.write(json.dumps(result) + "\n")
+        return True
+
+
+class BatchModel(BaseModel):
+    """
+    Model that answers `prompt` and `prompt_choices` through a batch API
+    instead of one request per call.
+
+    Every calling thread is parked until its request has gone through a
+    batch. A collector thread submits all pending requests as one JSONL
+    file once no new request arrived for `settle_time` seconds (or
+    `max_batch_size` are pending); each submitted batch is polled on its
+    own thread, which hands every result back to its caller, so requests
+    arriving meanwhile go out in the next batch without waiting for it.
+    Run under `ConcurrentRunner` with one worker per item, every item
+    therefore advances in lockstep: retrieval for all, then planning for
+    all, and so on, each stage resuming as its batch completes.
+
+    The id of every submitted batch and the request behind each of its
+    `custom_id`s are kept in a `.batch.json` file next to its input. On
+    start, batches a previous process submitted but never collected are
+    polled again, and a call repeating one of their requests waits for
+    that result instead of paying for a new one.
+
+    Arguments
+    ---------
+    model : BaseModel
+        Supplies the request parameters (`resolve_params`/`model_params`)
+    backend : BatchBackend
+        Where batches are submitted
+    work_dir : str
+        Directory keeping every batch's input and output JSONL files
+    """
+
+    def __init__(
+        self,
+        model: BaseModel,
+        backend: BatchBackend,
+        work_dir: str,
+        settle_time: float = 2.0,
+        max_batch_size: int = 50_000,
+        poll_interval: float = 30.0,
+    ):
+        self.model = model
+        self.backend = backend
+        self.work_dir = work_dir
+        self.settle_time = settle_time
+        self.max_batch_size = max_batch_size
+        self.poll_interval = poll_interval
+        os.makedirs(work_dir, exist_ok=True)
+
+        self._pending = []
+        self._submitted = 0
+        self._last_enqueue = 0.0
+        self._cond = threading.Condition()
+        self._recovered = {}        # request key -> futures of resumed batches
+        self._resume_outstanding()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def resolve_params(self, **overrides) -> dict:
+        if hasattr(self.model, "resolve_params"):
+            return self.model.resolve_params(**overrides)
+        return {**getattr(self.model, "model_params", {}), **overrides}
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        choices, prompt_tokens, completion_tokens = self._request(processed_input, overrides)
+        return choices[0], prompt_tokens, completion_tokens
+
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        """`n` completions of one prompt from a single batch request"""
+        return self._request(processed_input, {**overrides, "n": n})
+
+    def _request(self, processed_input: list[dict], overrides: dict):
+        body = self.resolve_params(**overrides)
+        body["messages"] = processed_input
+        key = request_key(body)
+        enqueued = time.monotonic()
+
+        with self._cond:
+            resumed = self._recovered.get(key)
+            if resumed:
+                # Already submitted by an earlier process
+                future = resumed.popleft()
+                if not resumed:
+                    del self._recovered[key]
+            else:
+                future = Future()
+                self._pending.append((f"request-{uuid.uuid4().hex}", key, body, future))
+                self._last_enqueue = time.monotonic()
+                self._cond.notify_all()
+
+        choices, prompt_tokens, completion_tokens, cached_tokens = future.result()
+        last_call.set({
+            "queue_time": time.monotonic() - enqueued,
+            "retries": 0,
+            "cached_tokens": cached_tokens,
+        })
+        return choices, prompt_tokens, completion_tokens
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    idle = time.monotonic() - self._last_enqueue
+                    if idle >= self.settle_time or len(self._pending) >= self.max_batch_size:
+                        batch = self._pending[:self.max_batch_size]
+                        del self._pending[:self.max_batch_size]
+                        return batch
+                    self._cond.wait(self.settle_time - idle)
+                else:
+                    self._cond.wait()
+
+    def _collect(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _path(self, name: str, kind: str) -> str:
+        return os.path.join(self.work_dir, f"{name}.{kind}")
+
+    def _save_state(self, state: dict):
+        path = self._path(state["name"], "batch.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _resume_outstanding(self):
+        for name in sorted(os.listdir(self.work_dir)):
+            if not name.endswith(".batch.json"):
+                continue
+            with open(os.path.join(self.work_dir, name), encoding="utf-8") as fp:
+                state = json.load(fp)
+            if state["status"] != "submitted":
+                continue
+
+            futures = {}
+            for custom_id, key in state["requests"].items():
+                futures[custom_id] = Future()
+                self._recovered.setdefault(key, deque()).append(futures[custom_id])
+            threading.Thread(target=self._finish_batch, args=(state, futures), daemon=True).start()
+
+    def _run_batch(self, batch: list):
+        self._submitted += 1
+        # Random suffix: a restarted process counts from 1 again
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self._submitted:05d}-{uuid.uuid4().hex[:6]}"
+        input_path = self._path(name, "input.jsonl")
+
+        with open(input_path, "w", encoding="utf-8") as fp:
+            for custom_id, _, body, _ in batch:
+                fp.write(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": body,
+                }) + "\n")
+
+        state = {
+            "name": name,
+            "batch_id": self.backend.submit(input_path),
+            "status": "submitted",
+            "requests": {custom_id: key for custom_id, key, _, _ in batch},
+        }
+        self._save_state(state)
+        # Polled on its own thread so the next batch can be submitted meanwhile
+        threading.Thread(
+            target=self._finish_batch,
+            args=(state, {custom_id: future for custom_id, _, _, future in batch}),
+            daemon=True,
+        ).start()
+
+    def _finish_batch(self, state: dict, futures: dict):
+        batch_id = state["batch_id"]
+        output_path = self._path(state["name"], "output.jsonl")
+        try:
+            while not self.backend.poll(batch_id, output_path):
+                time.sleep(self.poll_interval)
+            self._read_output(output_path, futures)
+        except Exception as e:
+            # Runs on its own thread: every caller still waiting is failed
+            for future in futures.values():
+                future.set_exception(e)
+            state["status"] = "failed"
+            self._save_state(state)
+            return
+
+        for future in futures.values():
+            future.set_exception(RuntimeError(f"No result for request in batch {batch_id}"))
+
+        state["status"] = "done"
+        self._save_state(state)
+
+    def _read_output(self, output_path: str, futures: dict):
+        """Resolves the future of every result in the output file, removing it from `futures`"""
+        with open(output_path, encoding="utf-8") as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                future = futures.pop(result["custom_id"], None)
+                if future is None:
+                    continue
+
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    future.set_exception(RuntimeError(f"Batch request failed: {result.get('error') or response}"))
+                    continue
+
+                body = response["body"]
+                usage = body.get("usage", {})
+                details = usage.get("prompt_tokens_details") or {}
+                choices = sorted(body["choices"], key=lambda choice: choice.get("index", 0))
+                future.set_result((
+                    [choice["message"]["content"] for choice in choices],
+                    usage.get("prompt_tokens", 0),
+                    usage.get("completion_tokens", 0),
+                    details.get("cached_tokens", 0),
+                ))
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from models.Base import BaseModel, last_call, prompt_choices
+
+
+# Request parameters that change the completion and therefore the cache key
+SAMPLING_PARAMS = (
+    "model",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "frequency_penalty",
+    "presence_penalty",
+)
+
+
+class ResponseCache(object):
+    """
+    Content-addressed store of LLM responses backed by a single SQLite file.
+
+    Entries are evicted least-recently-used first once either `max_entries`
+    or `max_bytes` (size of the stored responses) is exceeded. The original
+    prompt/completion token counts and the number of requests that produced
+    the response are stored with every response.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        max_bytes: int = 1 << 30,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, "
+            "completion_tokens INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "requests INTEGER NOT NULL DEFAULT 1)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+        if "requests" not in columns:
+            # Cache created before request counts were stored
+            self._conn.execute("ALTER TABLE responses ADD COLUMN requests INTEGER NOT NULL DEFAULT 1")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self._conn.commit()
+
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model_name: str, params: dict, processed_input: list[dict], variant: dict = None) -> str:
+        """`variant` tells apart calls whose result differs from a plain prompt"""
+        payload = {
+            "model": model_name,
+            "params": {k: params.get(k) for k in SAMPLING_PARAMS},
+            "messages": processed_input,
+        }
+        if variant is not None:
+            payload["variant"] = variant
+        payload = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """(response, prompt_tokens, completion_tokens, requests), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens, requests FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0], row[1], row[2], row[3]
+
+    def put(self, key: str, response: str, prompt_tokens: int, completion_tokens: int, requests: int = 1):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if old is not None:
+                self._count -= 1
+                self._bytes -= old[0]
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, prompt_tokens, completion_tokens, size, last_access, requests) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response, prompt_tokens, completion_tokens, size, time.time(), requests)
+            )
+            self._count += 1
+            self._bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._count > self.max_entries or self._bytes > self.max_bytes:
+            excess = max(1, self._count - self.max_entries)
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT ?",
+                (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany(
+                "DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows]
+            )
+            self._count -= len(rows)
+            self._bytes -= sum(size for _, size in rows)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        return self._count
+
+
+class CachedModel(BaseModel):
+    """
+    Wraps a model so identical requests are answered from a `ResponseCache`.
+
+    The key covers the model, its sampling parameters and the message list.
+    Requests sampled with temperature > 0 bypass the cache unless
+    `cache_sampled` is set, since their completions are not meant to repeat.
+    Hits return the token counts of the original completion, so cost
+    accounting downstream is unchanged. Streamed code completions are cut
+    short, so they are keyed apart from plain prompts, together with the
+    guards that cut them; `prompt_choices` stores the list of choices under
+    a key that includes `n`.
+    """
+
+    def __init__(self, model: BaseModel, cache: ResponseCache, cache_sampled: bool = False):
+        self.model = model
+        self.cache = cache
+        self.cache_sampled = cache_sampled
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's attributes (model_params, ...)
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def cache_key(self, processed_input: list[dict], variant: dict = None, **overrides):
+        if hasattr(self.model, "resolve_params"):
+            params = self.model.resolve_params(**overrides)
+        else:
+            params = {**getattr(self.model, "model_params", {}), **overrides}
+        if not self.cache_sampled and (params.get("temperature") or 0) > 0:
+            return None
+        model_name = params.get("model") or type(self.model).__name__
+        return self.cache.make_key(model_name, params, processed_input, variant)
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        key = self.cache_key(processed_input, **overrides)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                last_call.set({"cache_hit": True, "queue_time": 0.0, "retries": 0, "cached_tokens": 0})
+                return cached[:3]
+
+        response, prompt_tokens, completion_tokens = self.model.prompt(processed_input, **overrides)
+
+        if key is not None:
+            self.cache.put(key, response, prompt_tokens, completion_tokens)
+        return response, prompt_tokens, completion_tokens
+
+    def prompt_code(self, processed_input: list[dict], max_chars: int = None, max_preamble_chars: int = None, **overrides):
+        variant = {"stream_code": [max_chars, max_preamble_chars]}
+        key = self.cache_key(processed_input, variant, **overrides)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                last_call.set({"cache_hit": True, "queue_time": 0.0, "retries": 0, "cached_tokens": 0})
+                return cached[:3]
+
+        if hasattr(self.model, "prompt_code"):
+            result = self.model.prompt_code(
+                processed_input,
+                max_chars=max_chars,
+                max_preamble_chars=max_preamble_chars,
+                **overrides
+            )
+        else:
+            result = self.model.prompt(processed_input, **overrides)
+
+        if key is not None:
+            self.cache.put(key, *result)
+        return result
+
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        key = self.cache_key(processed_input, {"n": n}, **overrides)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                last_call.set({
+                    "cache_hit": True, "queue_time": 0.0, "retries": 0, "cached_tokens": 0, "requests": cached[3],
+                })
+                return json.loads(cached[0]), cached[1], cached[2]
+
+        choices, prompt_tokens, completion_tokens = prompt_choices(self.model, processed_input, n, **overrides)
+
+        if key is not None:
+            # One request per choice for models without native `n`
+            requests = (last_call.get() or {}).get("requests", 1)
+            self.cache.put(key, json.dumps(choices, ensure_ascii=False), prompt_tokens, completion_tokens, requests)
+        return choices, prompt_tokens, completion_tokens
+
+    async def aprompt(self, processed_input: list[dict], **overrides):
+        key = self.cache_key(processed_input, **overrides)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                last_call.set({"cache_hit": True, "queue_time": 0.0, "retries": 0, "cached_tokens": 0})
+                return cached[:3]
+
+        response, prompt_tokens, completion_tokens = await self.model.aprompt(processed_input, **overrides)
+
+        if key is not None:
+            self.cache.put(key, response, prompt_tokens, completion_tokens)
+        return response, prompt_tokens, completion_tokens
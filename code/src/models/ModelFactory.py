@@ -1,6 +1,7 @@
 
 from models.OpenAI import ChatGPT
 from models.OpenAI import GPT4
+from models.Replay import ReplayModel
 
 
 class ModelFactory:
@@ -11,5 +12,8 @@ class ModelFactory:
 
         elif model_name == "GPT4":
             return GPT4
+
+        elif model_name == "Replay":
+            return ReplayModel
         else:
             raise Exception(f"Unknown model name {model_name}")
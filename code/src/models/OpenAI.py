@@ -1,15 +1,66 @@
 import os
+import time
+import random
+import asyncio
+import weakref
 import dotenv
-from openai import OpenAI
+import httpx
+import openai
+from email.utils import parsedate_to_datetime
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
 
-from utils.token_count import token_count
+from models.Base import BaseModel, last_call
+from models.RateLimiter import RateLimiter
+from utils.token_count import token_count, string_token_count
+from utils.code_stream import CodeStreamExtractor
 
 dotenv.load_dotenv()
 
+DEFAULT_MAX_TOKENS = 4096
 
-class OpenAIBaseModel(BaseModel):
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def retry_after_seconds(error):
+    """Reads the server's retry-after hint from an API error, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prompt cache"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
 
 
+class OpenAIBaseModel(BaseModel):
+    # Async clients are shared by every model that talks to the same
+    # endpoint, one per event loop, so their connection pools are reused.
+    _async_clients = weakref.WeakKeyDictionary()
+
     def __init__(
         self,
         api_type=None,
@@ -22,6 +73,8 @@ class OpenAIBaseModel(BaseModel):
         top_p=0.95,
         frequency_penalty=0,
         presence_penalty=0,
+        max_connections=256,
+        keepalive_expiry=30,
     ):
         api_type = api_type or "openai"
         api_key = api_key or "key"
@@ -34,7 +87,16 @@ class OpenAIBaseModel(BaseModel):
             assert api_base is not None, "API URL must be provided as model config or environment variable (`AZURE_API_BASE`)"
             assert api_version is not None, "API version must be provided as model config or environment variable (`AZURE_API_VERSION`)"
 
-
+        self.api_type = api_type
+        self.api_base = api_base
+        self.api_version = api_version
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.openai = self._create_client(sync=True)
         
         # GPT parameters
         self.model_params = {}
@@ -46,6 +108,39 @@ class OpenAIBaseModel(BaseModel):
         self.model_params["presence_penalty"] = presence_penalty
 
 
+    def _create_client(self, sync: bool):
+        if sync:
+            http_client = httpx.Client(limits=self.limits)
+        else:
+            http_client = httpx.AsyncClient(limits=self.limits)
+
+        if self.api_type == "azure":
+            client_class = AzureOpenAI if sync else AsyncAzureOpenAI
+            return client_class(
+                api_key=self.api_key,
+                api_version=self.api_version,
+                azure_endpoint=self.api_base,
+                http_client=http_client,
+                max_retries=0,
+            )
+
+        client_class = OpenAI if sync else AsyncOpenAI
+        return client_class(
+            api_key=self.api_key,
+            base_url=self.api_base if self.api_base != "###" else None,
+            http_client=http_client,
+            max_retries=0,
+        )
+
+    @property
+    def async_openai(self):
+        loop = asyncio.get_running_loop()
+        clients = OpenAIBaseModel._async_clients.setdefault(loop, {})
+        key = (self.api_type, self.api_base, self.api_version, self.api_key)
+        if key not in clients:
+            clients[key] = self._create_client(sync=False)
+        return clients[key]
+
     @staticmethod
     def read_azure_env_vars():
         return {
@@ -66,6 +161,9 @@ class OpenAIBaseModel(BaseModel):
 
 
 class OpenAIModel(OpenAIBaseModel):
+    # Model used for every request regardless of `model_name`, if set
+    default_model = None
+
     def __init__(
         self,
         api_type=None,
@@ -78,6 +176,14 @@ class OpenAIModel(OpenAIBaseModel):
         top_p=0.95,
         frequency_penalty=0,
         presence_penalty=0,
+        max_connections=256,
+        keepalive_expiry=30,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        rate_limiter=None,
+        max_retries=5,
+        min_backoff=1,
+        max_backoff=60,
     ):
         super().__init__(
             api_type=api_type,
@@ -90,7 +196,18 @@ class OpenAIModel(OpenAIBaseModel):
             top_p=top_p,
             frequency_penalty=frequency_penalty,
             presence_penalty=presence_penalty,
+            max_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
         )
+
+        # Retries are scheduled here rather than inside the openai client so
+        # they go through the limiter and honour server retry-after hints
+        if rate_limiter is None and (requests_per_minute or tokens_per_minute):
+            rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
     
     def summarize_response(self, response):
         """Returns the first reply from the "assistant", if available"""
@@ -107,8 +224,42 @@ class OpenAIModel(OpenAIBaseModel):
         return response
 
 
-    # @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(5))
-    def prompt(self, processed_input: list[dict]):
+    def resolve_params(self, **overrides) -> dict:
+        """
+        Builds the request parameters for one call without touching the
+        shared `model_params`, so a single instance (and its connection
+        pool) can be used from many threads. `overrides` such as
+        `max_tokens` or `temperature` apply to this call only; `None`
+        values are ignored.
+        """
+        params = dict(self.model_params)
+        if self.default_model is not None:
+            params["model"] = self.default_model
+        if params["max_tokens"] is None:
+            params["max_tokens"] = DEFAULT_MAX_TOKENS
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        return params
+
+    def estimate_tokens(self, processed_input: list[dict], params: dict) -> int:
+        """Tokens a call is charged against the limiter before it is sent"""
+        if self.rate_limiter is None or not self.rate_limiter.tokens_per_minute:
+            return 0
+        return token_count(processed_input, model=params["model"]) + params["max_tokens"] * params.get("n", 1)
+
+    def retry_delay(self, error: Exception, attempt: int):
+        """Seconds to wait before retrying `error`, or None to give up"""
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= self.max_retries:
+            return None
+
+        delay = retry_after_seconds(error)
+        if delay is not None:
+            # Every caller sharing the limiter backs off, not only this one
+            if self.rate_limiter is not None:
+                self.rate_limiter.pause(delay)
+            return delay
+        return random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** attempt))
+
+    def prompt(self, processed_input: list[dict], **overrides):
         """
         OpenAI API ChatCompletion implementation
 
@@ -118,31 +269,193 @@ class OpenAIModel(OpenAIBaseModel):
             Must be list of dictionaries, where each dictionary has two keys;
             "role" defines a role in the chat (e.g. "system", "user") and
             "content" defines the actual message for that turn
+        overrides : dict
+            Per-call request parameters (e.g. `max_tokens`, `temperature`)
 
         Returns
         -------
         response : OpenAI API response
             Response from the openai python library
 
+        Queueing time, retries and the number of prompt tokens served from
+        the provider's prompt cache are available afterwards through
+        `last_call_info()`.
         """
-        self.model_params["max_tokens"] = 4096
+        response = self._create(processed_input, **overrides)
+        return response.choices[0].message.content, response.usage.prompt_tokens, response.usage.completion_tokens
 
-        response = self.openai.chat.completions.create(
-            messages=processed_input,
-            **self.model_params
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        """
+        Samples `n` completions of one prompt in a single request. Returns
+        the list of completions, the prompt tokens (sent and billed once)
+        and the completion tokens of all choices together.
+        """
+        response = self._create(processed_input, n=n, **overrides)
+        choices = sorted(response.choices, key=lambda choice: choice.index)
+        return (
+            [choice.message.content for choice in choices],
+            response.usage.prompt_tokens,
+            response.usage.completion_tokens,
         )
 
+    def _begin(self, processed_input: list[dict], overrides: dict, **info):
+        """Resolves a call's parameters and publishes its `last_call` info"""
+        params = self.resolve_params(**overrides)
+        estimated = self.estimate_tokens(processed_input, params)
+        info = {"queue_time": 0.0, "retries": 0, "retry_wait": 0.0, **info}
+        last_call.set(info)
+        return params, estimated, info
+
+    def _backoff(self, error: Exception, estimated: int, info: dict):
+        """
+        Settles a failed attempt and returns the seconds to wait before the
+        next one, or None when `error` must be raised
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(estimated, 0)
+        delay = self.retry_delay(error, info["retries"])
+        if delay is not None:
+            info["retries"] += 1
+            info["retry_wait"] += delay
+        return delay
+
+    def _request(self, send, estimated: int, info: dict):
+        """Calls `send()` through the limiter, retrying retryable errors"""
+        while True:
+            if self.rate_limiter is not None:
+                info["queue_time"] += self.rate_limiter.acquire(estimated)
+            try:
+                return send()
+            except Exception as e:
+                delay = self._backoff(e, estimated, info)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def _arequest(self, send, estimated: int, info: dict):
+        """Asyncio counterpart of `_request`; `send()` returns an awaitable"""
+        while True:
+            if self.rate_limiter is not None:
+                info["queue_time"] += await self.rate_limiter.aacquire(estimated)
+            try:
+                return await send()
+            except Exception as e:
+                delay = self._backoff(e, estimated, info)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def _create(self, processed_input: list[dict], **overrides):
+        params, estimated, info = self._begin(processed_input, overrides)
+        response = self._request(
+            lambda: self.openai.chat.completions.create(messages=processed_input, **params),
+            estimated,
+            info,
+        )
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(estimated, response.usage.total_tokens)
+        info["cached_tokens"] = cached_prompt_tokens(response.usage)
+        return response
+
+    def stream(self, processed_input: list[dict], **overrides):
+        """
+        Streaming counterpart of `prompt`: yields the completion text as it
+        arrives. Closing the generator early closes the HTTP stream, so no
+        further completion tokens are generated. Token counts are available
+        afterwards through `last_call_info()`; for a stream closed before
+        the provider reported usage they are counted locally.
+        """
+        params, estimated, info = self._begin(processed_input, overrides, aborted=True)
+        stream = self._request(
+            lambda: self.openai.chat.completions.create(
+                messages=processed_input,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params
+            ),
+            estimated,
+            info,
+        )
+
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            info["aborted"] = False
+        finally:
+            stream.close()
+            if usage is not None:
+                info["prompt_tokens"] = usage.prompt_tokens
+                info["completion_tokens"] = usage.completion_tokens
+                info["cached_tokens"] = cached_prompt_tokens(usage)
+            else:
+                info["prompt_tokens"] = token_count(processed_input, model=params["model"])
+                info["completion_tokens"] = string_token_count("".join(parts), model=params["model"])
+                info["cached_tokens"] = 0
+            if self.rate_limiter is not None:
+                self.rate_limiter.settle(estimated, info["prompt_tokens"] + info["completion_tokens"])
+
+    def prompt_code(
+        self,
+        processed_input: list[dict],
+        max_chars: int = None,
+        max_preamble_chars: int = None,
+        **overrides
+    ):
+        """
+        Streams a completion that is expected to contain a fenced code block
+        and stops it as soon as the block is closed, or once the text runs
+        past `max_chars` or no fence opened within `max_preamble_chars`.
+        Returns the text received up to that point with its token counts,
+        like `prompt`.
+        """
+        extractor = CodeStreamExtractor(max_chars, max_preamble_chars)
+        stream = self.stream(processed_input, **overrides)
+        try:
+            for delta in stream:
+                if extractor.feed(delta):
+                    break
+        finally:
+            stream.close()
+
+        info = last_call.get()
+        info["stop_reason"] = extractor.reason
+        text = extractor.text
+        if extractor.reason == "fence_closed":
+            # Keep the closing fence so `parse_code` sees a complete block
+            text = text[:text.rindex("```") + 3]
+        return text, info["prompt_tokens"], info["completion_tokens"]
+
+    async def aprompt(self, processed_input: list[dict], **overrides):
+        """
+        Asyncio-native counterpart of `prompt`, sent through the async
+        client shared by all models on the same endpoint and event loop.
+        Returns the same (content, prompt_tokens, completion_tokens) tuple.
+        """
+        params, estimated, info = self._begin(processed_input, overrides)
+        response = await self._arequest(
+            lambda: self.async_openai.chat.completions.create(messages=processed_input, **params),
+            estimated,
+            info,
+        )
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(estimated, response.usage.total_tokens)
+        info["cached_tokens"] = cached_prompt_tokens(response.usage)
+
         return response.choices[0].message.content, response.usage.prompt_tokens, response.usage.completion_tokens
 
 
 class GPT4(OpenAIModel):
-    def prompt(self, processed_input: list[dict]):
-        self.model_params["model"] = "gpt-4o-2024-11-20"
-        #self.model_params["model"] = "gpt-4o-mini-2024-07-18"
-        return super().prompt(processed_input)
+    default_model = "gpt-4o-2024-11-20"
+    # default_model = "gpt-4o-mini-2024-07-18"
 
 
 class ChatGPT(OpenAIModel):
-    def prompt(self, processed_input: list[dict]):
-        self.model_params["model"] = "gpt-3.5-turbo"
-        return super().prompt(processed_input)
\ No newline at end of file
+    default_model = "gpt-3.5-turbo"
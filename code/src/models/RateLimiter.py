@@ -0,0 +1,114 @@
+import time
+import asyncio
+import threading
+
+
+class RateLimiter(object):
+    """
+    Client-side token buckets for requests per minute and tokens per minute.
+
+    Both buckets start full and refill continuously. A call is admitted once
+    both hold enough budget; `pause` blocks every caller until a server
+    supplied retry-after deadline has passed. A limit of `None` disables
+    that bucket. One limiter should be shared by all models that draw on
+    the same deployment quota.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self._lock = threading.Lock()
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """
+        Takes one request and `tokens` from the buckets if both allow it and
+        returns 0, otherwise returns the seconds to wait before retrying.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0.0, self._paused_until - now)
+            if self.requests_per_minute and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                # A single call larger than the bucket would never fit
+                tokens = min(tokens, self.tokens_per_minute)
+                if self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+
+            if wait > 0:
+                return wait
+
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+            return 0.0
+
+    def headroom(self) -> float:
+        """
+        Fraction of the quota currently available, from 0 (paused or
+        empty) to 1 (full buckets or no limits)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._paused_until > now:
+                return 0.0
+            fractions = [1.0]
+            if self.requests_per_minute:
+                fractions.append(max(0.0, self._requests) / self.requests_per_minute)
+            if self.tokens_per_minute:
+                fractions.append(max(0.0, self._tokens) / self.tokens_per_minute)
+            return min(fractions)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Blocks until the call is admitted; returns the time spent queueing."""
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return time.monotonic() - start
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return time.monotonic() - start
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Corrects the token bucket once the real usage of a call is known."""
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + estimated_tokens - actual_tokens
+            )
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+
+from models.Base import BaseModel, last_call, prompt_choices
+
+
+def transcript_key(processed_input: list[dict], n: int = None) -> str:
+    # `n` choices of a prompt are recorded apart from its single completion
+    payload = json.dumps(processed_input if n is None else [processed_input, n], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranscriptRecorder(BaseModel):
+    """
+    Wraps a live model and appends every call (`prompt`, `aprompt`,
+    `prompt_code`, `prompt_choices`) to a JSONL transcript that
+    `ReplayModel` can serve later. Attributes not defined here are looked
+    up on the wrapped model.
+    """
+
+    def __init__(self, model: BaseModel, path: str):
+        self.model = model
+        self.path = path
+        self._lock = threading.Lock()
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        started = time.monotonic()
+        result = self.model.prompt(processed_input, **overrides)
+        self._record(processed_input, result, started)
+        return result
+
+    def prompt_code(self, processed_input: list[dict], max_chars: int = None, max_preamble_chars: int = None, **overrides):
+        # Recorded as the reply of the prompt, cut where the stream stopped,
+        # which is what a replayed run must see
+        started = time.monotonic()
+        if hasattr(self.model, "prompt_code"):
+            result = self.model.prompt_code(
+                processed_input,
+                max_chars=max_chars,
+                max_preamble_chars=max_preamble_chars,
+                **overrides
+            )
+        else:
+            result = self.model.prompt(processed_input, **overrides)
+        self._record(processed_input, result, started)
+        return result
+
+    async def aprompt(self, processed_input: list[dict], **overrides):
+        started = time.monotonic()
+        result = await self.model.aprompt(processed_input, **overrides)
+        self._record(processed_input, result, started)
+        return result
+
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        started = time.monotonic()
+        choices, prompt_tokens, completion_tokens = prompt_choices(self.model, processed_input, n, **overrides)
+        self._write({
+            "key": transcript_key(processed_input, n),
+            "response": choices,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": round(time.monotonic() - started, 4),
+            "requests": (last_call.get() or {}).get("requests", 1),
+        })
+        return choices, prompt_tokens, completion_tokens
+
+    def _record(self, processed_input: list[dict], result: tuple, started: float):
+        content, prompt_tokens, completion_tokens = result
+        self._write({
+            "key": transcript_key(processed_input),
+            "response": content,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": round(time.monotonic() - started, 4),
+        })
+
+    def _write(self, record: dict):
+        with self._lock:
+            self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+
+class ReplayModel(BaseModel):
+    """
+    Offline model serving the responses of a recorded transcript, for
+    benchmarking the pipeline without a paid API.
+
+    A prompt is answered with the response recorded for the same messages.
+    Latency and token counts are the recorded ones unless synthetic
+    distributions are configured: `latency` is the mean of a log-normal
+    delay with shape `latency_sigma`, and `token_jitter` is the shape of a
+    log-normal factor applied to the recorded token counts. Every draw is
+    seeded by `seed`, the prompt and its occurrence, so a rerun reproduces
+    the same delays and counts whatever the thread interleaving.
+
+    Arguments
+    ---------
+    transcript_path : str
+        Transcript written by `TranscriptRecorder`; defaults to the
+        `REPLAY_TRANSCRIPT` environment variable
+    cycle : bool
+        Answer prompts missing from the transcript with the recorded
+        responses in turn instead of raising KeyError
+    """
+
+    def __init__(
+        self,
+        transcript_path: str = None,
+        latency: float = None,
+        latency_sigma: float = 0.0,
+        token_jitter: float = 0.0,
+        seed: int = 0,
+        cycle: bool = False,
+        **kwargs
+    ):
+        transcript_path = transcript_path or os.getenv("REPLAY_TRANSCRIPT")
+        assert transcript_path is not None, "Transcript must be provided as model config or environment variable (`REPLAY_TRANSCRIPT`)"
+        if latency is None and os.getenv("REPLAY_LATENCY"):
+            latency = float(os.getenv("REPLAY_LATENCY"))
+
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.token_jitter = token_jitter
+        self.seed = seed
+        self.cycle = cycle
+        self.model_params = {"model": "replay", **kwargs}
+
+        self.records = {}
+        self._order = []
+        with open(transcript_path, encoding="utf-8") as fp:
+            for line in fp:
+                if line.strip():
+                    record = json.loads(line)
+                    # The last recording of a prompt wins
+                    self.records[record["key"]] = record
+                    self._order.append(record)
+
+        self._seen = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _lognormal(self, rng: random.Random, mean: float, sigma: float) -> float:
+        if sigma <= 0:
+            return mean
+        # Shifted so that the distribution keeps the requested mean
+        return mean * rng.lognormvariate(-sigma * sigma / 2, sigma)
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        response, prompt_tokens, completion_tokens = self._serve(transcript_key(processed_input))
+        if isinstance(response, list):
+            # Cycled onto a recording of `prompt_choices`
+            response = response[0]
+        return response, prompt_tokens, completion_tokens
+
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        response, prompt_tokens, completion_tokens = self._serve(transcript_key(processed_input, n))
+        if not isinstance(response, list):
+            response = [response] * n
+        return response, prompt_tokens, completion_tokens
+
+    def _serve(self, key: str):
+        with self._lock:
+            occurrence = self._seen.get(key, 0)
+            self._seen[key] = occurrence + 1
+            record = self.records.get(key)
+            if record is None:
+                if not self.cycle or not self._order:
+                    raise KeyError(f"No recorded response for prompt {key[:12]}")
+                record = self._order[self._next % len(self._order)]
+                self._next += 1
+
+        rng = random.Random(f"{self.seed}:{key}:{occurrence}")
+        latency = record.get("latency", 0.0) if self.latency is None else self.latency
+        delay = self._lognormal(rng, latency, self.latency_sigma)
+        if delay > 0:
+            time.sleep(delay)
+
+        prompt_tokens = record["prompt_tokens"]
+        completion_tokens = record["completion_tokens"]
+        if self.token_jitter > 0:
+            prompt_tokens = max(1, round(self._lognormal(rng, prompt_tokens, self.token_jitter)))
+            completion_tokens = max(1, round(self._lognormal(rng, completion_tokens, self.token_jitter)))
+
+        last_call.set({"queue_time": 0.0, "retries": 0, "cached_tokens": 0, "requests": record.get("requests", 1)})
+        return record["response"], prompt_tokens, completion_tokens
@@ -0,0 +1,214 @@
+import time
+import random
+import hashlib
+import threading
+
+from models.Base import BaseModel, last_call, prompt_choices, route_key
+from models.OpenAI import RETRYABLE_ERRORS, retry_after_seconds
+
+
+def is_failover_error(error: Exception) -> bool:
+    """
+    Errors another deployment may not share: throttling, timeouts, lost
+    connections and server errors. Anything else (a bad request, an
+    authentication error) would fail on every endpoint.
+    """
+    if isinstance(error, RETRYABLE_ERRORS + (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in (408, 429) or status >= 500)
+
+
+class Endpoint(object):
+    __slots__ = ("model", "name", "latency", "in_flight", "failures", "down_until")
+
+    def __init__(self, model: BaseModel, name: str):
+        self.model = model
+        self.name = name
+        self.latency = None         # EWMA of the service time, seconds
+        self.in_flight = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def headroom(self) -> float:
+        limiter = getattr(self.model, "rate_limiter", None)
+        return 1.0 if limiter is None else limiter.headroom()
+
+
+class RouterModel(BaseModel):
+    """
+    Spreads calls over several deployments, each a model with its own
+    endpoint, key and (optionally) `RateLimiter`.
+
+    An endpoint is picked at random with weight proportional to the share
+    of its quota still available, divided by its observed latency and by
+    the calls it already has in flight. A call failing with a throttling,
+    timeout, connection or server error is retried on the next endpoint
+    and the failed one is left out for `failure_cooldown` seconds
+    (doubling while it keeps failing); other errors are raised at once.
+    Once every endpoint failed a call, the router backs off (honouring
+    retry-after) and starts over, up to `max_retries` times, so the
+    routed models should not retry themselves: `from_configs` builds them
+    with `max_retries=0`. With `pin_items`, every call carrying the same
+    `route_key` (set per item by the strategy) goes to the same endpoint
+    through rendezvous hashing, as long as that endpoint is up.
+
+    Arguments
+    ---------
+    models : list
+        One model per deployment, e.g. from `RouterModel.from_configs`
+    latency_alpha : float
+        Smoothing factor of the per-endpoint latency average
+    """
+
+    def __init__(
+        self,
+        models: list,
+        pin_items: bool = False,
+        latency_alpha: float = 0.2,
+        failure_cooldown: float = 30.0,
+        seed: int = None,
+        max_retries: int = 5,
+        min_backoff: float = 1,
+        max_backoff: float = 60,
+    ):
+        assert models, "At least one model must be provided."
+        self.endpoints = [
+            Endpoint(model, f"{i}:{getattr(model, 'api_base', type(model).__name__)}")
+            for i, model in enumerate(models)
+        ]
+        self.pin_items = pin_items
+        self.latency_alpha = latency_alpha
+        self.failure_cooldown = failure_cooldown
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_configs(cls, configs: list[dict], model_class=None, **kwargs):
+        """
+        Builds one model per config, e.g. {"api_type": "azure", "api_base":
+        ..., "api_key": ..., "api_version": ..., "tokens_per_minute": ...}
+        """
+        if model_class is None:
+            from models.OpenAI import OpenAIModel as model_class
+        # The router retries; an endpoint retrying on its own would hold a
+        # call for minutes before it can fail over
+        return cls([model_class(**{"max_retries": 0, **config}) for config in configs], **kwargs)
+
+    @property
+    def model_params(self) -> dict:
+        return self.endpoints[0].model.model_params
+
+    def resolve_params(self, **overrides) -> dict:
+        model = self.endpoints[0].model
+        if hasattr(model, "resolve_params"):
+            return model.resolve_params(**overrides)
+        return {**model.model_params, **overrides}
+
+    def _weight(self, endpoint: Endpoint, default_latency: float) -> float:
+        latency = endpoint.latency if endpoint.latency is not None else default_latency
+        # A small floor keeps an endpoint with an empty bucket selectable
+        # once every endpoint is saturated
+        return (endpoint.headroom() + 1e-3) / (max(latency, 1e-3) * (1 + endpoint.in_flight))
+
+    def choose(self, exclude: set = ()) -> Endpoint:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            up = [e for e in candidates if e.down_until <= now]
+            # With every endpoint down, the one that recovers first is tried
+            candidates = up or sorted(candidates, key=lambda e: e.down_until)[:1]
+
+            key = route_key.get() if self.pin_items else None
+            if key is not None:
+                return max(
+                    candidates,
+                    key=lambda e: hashlib.md5(f"{key}|{e.name}".encode("utf-8")).digest(),
+                )
+
+            known = [e.latency for e in self.endpoints if e.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            weights = [self._weight(e, default_latency) for e in candidates]
+            return self._random.choices(candidates, weights=weights)[0]
+
+    def _record(self, endpoint: Endpoint, elapsed: float = None, failed: bool = False):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.down_until = time.monotonic() + self.failure_cooldown * 2 ** min(endpoint.failures - 1, 5)
+                return
+            endpoint.failures = 0
+            if endpoint.latency is None:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency += self.latency_alpha * (elapsed - endpoint.latency)
+
+    def prompt(self, processed_input: list[dict], **overrides):
+        return self._route(lambda model: model.prompt(processed_input, **overrides))
+
+    def prompt_choices(self, processed_input: list[dict], n: int, **overrides):
+        return self._route(lambda model: prompt_choices(model, processed_input, n, **overrides))
+
+    def _route(self, call):
+        """Runs `call(model)` on a chosen endpoint, failing over to the others"""
+        tried = set()
+        failovers = 0
+        retries = 0
+        retry_wait = 0.0
+        while True:
+            endpoint = self.choose(exclude=tried)
+            with self._lock:
+                endpoint.in_flight += 1
+
+            started = time.monotonic()
+            try:
+                result = call(endpoint.model)
+            except Exception as e:
+                if not is_failover_error(e):
+                    # The request itself is at fault, not the endpoint
+                    with self._lock:
+                        endpoint.in_flight -= 1
+                    raise
+                self._record(endpoint, failed=True)
+                tried.add(endpoint)
+                if len(tried) == len(self.endpoints):
+                    # Every endpoint failed: back off, then start a new round
+                    if retries >= self.max_retries:
+                        raise
+                    delay = retry_after_seconds(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** retries))
+                    time.sleep(delay)
+                    retries += 1
+                    retry_wait += delay
+                    tried = set()
+                    continue
+                failovers += 1
+                continue
+
+            info = dict(last_call.get() or {})
+            # Time spent in the endpoint's own limiter is not its latency
+            self._record(endpoint, time.monotonic() - started - info.get("queue_time", 0.0))
+            info["endpoint"] = endpoint.name
+            info["failovers"] = failovers
+            info["retries"] = info.get("retries", 0) + retries
+            info["retry_wait"] = info.get("retry_wait", 0.0) + retry_wait
+            last_call.set(info)
+            return result
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "endpoint": e.name,
+                    "latency": e.latency,
+                    "in_flight": e.in_flight,
+                    "failures": e.failures,
+                    "down": e.down_until > time.monotonic(),
+                }
+                for e in self.endpoints
+            ]
@@ -7,6 +7,20 @@ import sys
 import time
 
 from copy import deepcopy
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.event_log import EventLogger, correlation_id
+from utils.parse_tags import parse_tags
+from utils.instrumentation import Instrumentation
+from promptings.Budget import BudgetController, current_budget
+from results.Checkpoints import CheckpointStore, current_checkpoint
+from models.Base import last_call, prompt_choices, route_key
+from promptings.RetrievalMemory import RetrievalMemory
+from promptings.DebugContext import DebugContext
+from promptings.EvaluationMemo import EvaluationMemo, code_fingerprint, current_memo
 
 
 
@@ -17,43 +31,173 @@ class Blueprint2Code(BaseStrategy):
             k: int = 3,
             t: int = 5,
             *args,
+            plan_concurrency: int = 1,
+            stage_params: dict = None,
+            sample_io_evaluator=None,
+            speculative_plans: int = 0,
+            event_logger: EventLogger = None,
+            instrumentation: Instrumentation = None,
+            budget: BudgetController = None,
+            checkpoints: CheckpointStore = None,
+            retrieval_memory: RetrievalMemory = None,
+            stream_code: dict = None,
+            debug_context: DebugContext = None,
+            eval_memo: EvaluationMemo = None,
+            on_cycle: str = None,
+            multi_sample: bool = False,
             **kwargs
     ):
         super().__init__(*args, **kwargs)
         self.k = k
         self.t = t
+        # Number of exemplar planning chains run concurrently per item
+        self.plan_concurrency = max(1, plan_concurrency)
+        # Per-stage request overrides, e.g. {"debugging": {"temperature": 0.7}}.
+        # Stages: retrieval, planning, verification, coding, debugging
+        self.stage_params = stage_params or {}
+        # Optional faster sample-IO backend, e.g. utils.sandbox.SandboxPool
+        self.sample_io_evaluator = sample_io_evaluator
+        # Generate and debug code for the top-m ranked plans concurrently,
+        # keeping the first that passes; 0 or 1 keeps the sequential search
+        self.speculative_plans = speculative_plans
+        self.log = event_logger or EventLogger()
+        # Per-stage spans; the default hook records nothing
+        self.instrumentation = instrumentation or Instrumentation()
+        # Per-item token / time limits and confidence cut-offs; none by default
+        self.budget = budget or BudgetController()
+        # Stage outputs of unfinished passes, replayed when a pass is rerun
+        self.checkpoints = checkpoints
+        # Retrieval outputs of past items, served for near-duplicate problems
+        self.retrieval_memory = retrieval_memory
+        # Stream coding/debugging completions and stop at the closing code
+        # fence; guards as keyword arguments, e.g. {"max_chars": 12000}
+        self.stream_code = stream_code
+        # Token-budgeted code/diff/failure history for debugging prompts in
+        # place of the whole previous response and test report
+        self.debug_context = debug_context
+        if debug_context is not None and debug_context.model is None:
+            # The model actually sent (e.g. a class's `default_model`), which
+            # `model_params` alone does not show
+            if hasattr(self.model, "resolve_params"):
+                params = self.model.resolve_params()
+            else:
+                params = getattr(self.model, "model_params", {})
+            debug_context.model = params.get("model") or "gpt-3.5-turbo"
+        # Sample-IO results shared by all items; a fresh memo per pass if None
+        self.eval_memo = eval_memo
+        # When debugging returns a candidate seen before in the chain:
+        # "next_plan" gives up on the plan, "temperature" first retries with
+        # a raised debugging temperature; None keeps debugging
+        self.on_cycle = on_cycle
+        # Draw all k plans from one planning request (`n` choices) and score
+        # them in one verification request instead of k chains; give the
+        # planning stage a temperature > 0 through `stage_params`
+        self.multi_sample = multi_sample
 
-    def xml_to_dict(self, element):
-        result = {}
-        for child in element:
-            if child:
-                child_data = self.xml_to_dict(child)
-                if child.tag in result:
-                    if isinstance(result[child.tag], list):
-                        result[child.tag].append(child_data)
-                    else:
-                        result[child.tag] = [result[child.tag], child_data]
-                else:
-                    result[child.tag] = child_data
+    @staticmethod
+    def submit(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+        # Worker threads keep the item's correlation id for logging
+        return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def item_budget(self):
+        return current_budget.get() or self.budget.start()
+
+    def stage_chat(self, stage: str, processed_input: list[dict], n: int = None, **overrides):
+        """
+        Returns (response, prompt tokens, completion tokens); with `n`, the
+        list of choices and the number of requests the model made for them
+        """
+        with self.instrumentation.span(f"llm.{stage}", stage=stage) as span:
+            checkpoint = current_checkpoint.get()
+            if checkpoint is not None:
+                key = checkpoint.key(stage, processed_input)
+                saved = checkpoint.get(key)
+                if saved is not None:
+                    # Already paid for by an interrupted run of this pass
+                    result = (saved["response"], saved["prompt_tokens"], saved["completion_tokens"])
+                    self.item_budget().charge(result[1] + result[2])
+                    span.set(prompt_tokens=result[1], completion_tokens=result[2], replayed=True)
+                    if n is not None:
+                        return (*result, saved.get("requests", 1))
+                    return result
+
+            overrides = {**self.stage_params.get(stage, {}), **overrides}
+            if n is not None:
+                # `n` completions of one prompt; the first element is a list
+                result = prompt_choices(self.model, processed_input, n, **overrides)
+            elif (
+                self.stream_code is not None
+                and stage in ("coding", "debugging")
+                and hasattr(self.model, "prompt_code")
+            ):
+                result = self.model.prompt_code(processed_input, **self.stream_code, **overrides)
             else:
-                result[child.tag] = child.text
+                # Overrides are resolved per call by the model, the shared
+                # instance is untouched
+                result = self.model.prompt(processed_input, **overrides)
+
+            call = self.model.last_call_info() if hasattr(self.model, "last_call_info") else {}
+            # Models without native `n` sample one request per choice
+            requests = {} if n is None else {"requests": (last_call.get() or {}).get("requests", 1)}
+
+            if checkpoint is not None:
+                checkpoint.put(
+                    key, stage,
+                    response=result[0], prompt_tokens=result[1], completion_tokens=result[2],
+                    **requests,
+                )
+
+            self.item_budget().charge(result[1] + result[2], call.get("cached_tokens", 0))
+
+            span.set(
+                prompt_tokens=result[1],
+                cached_prompt_tokens=call.get("cached_tokens", 0),
+                completion_tokens=result[2],
+                queue_wait=call.get("queue_time", 0.0),
+                retries=call.get("retries", 0),
+                **requests,
+            )
+        if n is not None:
+            return (*result, requests["requests"])
         return result
 
-    def parse_xml(self, response: str) -> dict:
-        if '```xml' in response:
-            response = response.replace('```xml', '')
-        if '```' in response:
-            response = response.replace('```', '')
+    def evaluate_sample_io(self, item: dict, code: str):
+        with self.instrumentation.span("eval.sample_io") as span:
+            memo = current_memo.get()
+            if memo is not None:
+                memo_key = memo.key(item, code_fingerprint(code, self.language))
+                remembered = memo.get(memo_key)
+                if remembered is not None:
+                    # Same candidate up to formatting was already run
+                    span.set(passed=remembered[0], memo_hit=True)
+                    return remembered
+
+            checkpoint = current_checkpoint.get()
+            if checkpoint is not None:
+                key = checkpoint.key("sample_io", code)
+                saved = checkpoint.get(key)
+                if saved is not None:
+                    span.set(passed=saved["passed"], replayed=True)
+                    if memo is not None:
+                        memo.put(memo_key, saved["passed"], saved["test_log"])
+                    return saved["passed"], saved["test_log"]
+
+            evaluator = self.sample_io_evaluator
+            if evaluator is not None and evaluator.supports(self.language):
+                passed, test_log = evaluator.evaluate_sample_io(item, code, self.language)
+            else:
+                passed, test_log = self.data.evaluate_sample_io(item, code, self.language)
+            span.set(passed=passed)
 
-        try:
-            root = ET.fromstring(response)
-        except:
-            try:
-                root = ET.fromstring('<root>\n' + response + '\n</root>')
-            except:
-                root = ET.fromstring('<root>\n' + response)
+            if checkpoint is not None:
+                checkpoint.put(key, "sample_io", passed=passed, test_log=test_log)
+            if memo is not None:
+                memo.put(memo_key, passed, test_log)
+        return passed, test_log
 
-        result = self.xml_to_dict(root)
+    def parse_xml(self, response: str) -> dict:
+        # Single scan over the known tags; tolerates malformed responses
+        result = parse_tags(response)
 
 
         if "problem" in result:
@@ -83,17 +227,6 @@ class Blueprint2Code(BaseStrategy):
             return code_blocks[-1].strip()
         return response
 
-    @staticmethod
-    def trim_text(text: str, trimmed_text: str):
-        return text.replace(trimmed_text, '').strip()
-
-    @staticmethod
-    def replace_tag(text: str, tag: str):
-        if f'<{tag}><![CDATA[' in text and f']]></{tag}>' in text:
-            return text
-        else:
-            return text.replace(f'<{tag}>', f'<{tag}><![CDATA[').replace(f'</{tag}>', f']]></{tag}>').strip()
-
     @staticmethod
     def get_sample_io_str(sample_io: any) -> str:
         if len(sample_io) > 0:
@@ -103,129 +236,381 @@ class Blueprint2Code(BaseStrategy):
                 return "\n".join([f"Input:\n{io['input']}\nExpected output:\n{io['output'][0]}" for io in sample_io])
         return sample_io
 
-    def run_single_pass(self, item: dict):
-        print("", flush=True)
-
-        # 1. 增强检索智能体：学习代码生成技巧
-        input_kb_exemplars = [
-            {
-                "role": "user",
-                "content": f"""Given a problem, provide relevant problems and learn code generation techniques from them. Also identify the algorithm behind the problem and explain its tutorial.
-# Problem:
+    def shared_prefix(
+            self,
+            item: dict,
+            algorithm_prompt: str,
+            learned_techniques: str,
+            sample_io_prompt: str,
+    ) -> str:
+        """
+        Item context that opens every planning, verification, coding and
+        debugging prompt. It is built once per pass and kept byte-identical,
+        so provider-side prompt caching can serve it after the first call.
+        """
+        return f"""# Problem:
 {self.data.get_prompt(item)}
 
-# Exemplars:
-Recall {self.k} relevant and distinct problems (different from the given problem). For each problem:
-1. Describe it concisely
-2. Generate {self.language} code step by step to solve that problem
-3. Analyze and extract 1-3 key code generation techniques used in the solution
-4. Generate a detailed planning to solve that problem
+# Sample Test Cases:
+{sample_io_prompt}
 
 # Algorithm:
+{algorithm_prompt}
+
+# Learned Techniques:
+{learned_techniques}
 
 ----------------
-Important:
-Your response must follow the following xml format:
+"""
 
-<root>
-<problem>
-<description>
-# Describe the problem concisely.
-</description>
-<code>
-# Let's think step by step to solve this problem in {self.language} programming language.
-</code>
-<techniques>
-# Extract 1-3 key code generation techniques used in this solution.
-</techniques>
-<planning>
-# Detailed planning to solve this problem.
-</planning>
-</problem>
+    def plan_with_exemplar(
+            self,
+            item: dict,
+            example_no: int,
+            example,
+            shared_prefix: str,
+    ):
+        """
+        Runs one planning -> verification chain for a single exemplar.
+        Returns the plan, its confidence, the exemplar and the tokens and
+        api calls spent, so chains can run concurrently without touching
+        shared state.
+        """
+        pr_tok, com_tok, api_calls = 0, 0, 0
+
+        # 确保示例是字典格式
+        if isinstance(example, str):
+            example = {"description": example, "code": "", "planning": "", "techniques": ""}
+
+        example_problem = example.get("description", "")
+        example_planning = example.get("planning", "")
+        example_techniques = example.get("techniques", "")
+
+        # 2. 增强计划智能体：生成更详细的计划
+        input_for_problem_planning = [
+            {
+                "role": "user",
+                "content": f"""{shared_prefix}Given the competitive programming problem above, generate a detailed, step-by-step plan to solve it.
+# Example Problem:
+{example_problem}
 
-# Add more problems here...
+# Example Techniques:
+{example_techniques}
 
-<algorithm>
-# Identify the algorithm (Brute-force, Dynamic Programming, Divide-and-conquer, Greedy, Backtracking, Recursive, Binary search, etc.) that needs to be used to solve the original problem.
-# Write a useful tutorial about the identified algorithm. Provide a high-level generic tutorial for solving this type of problem. Do not generate code.
-</algorithm>
+# Example Planning:
+{example_planning}
 
-<learned_techniques>
-# Summarize the key code generation techniques learned from all the examples (3-5 techniques).
-</learned_techniques>
+# Detailed Planning:
+Create a detailed, step-by-step plan to solve the problem. Structure your plan as:
+1. Step 1: [Description of first step]
+2. Step 2: [Description of second step]
+...
+n. Step n: [Description of final step]
+
+Important: 
+- Be specific and concrete in each step
+- Consider edge cases and input/output handling
+- Include time and space complexity considerations
+- Do not generate code, only the planning
+"""
+            }
+        ]
+
+        self.log.text("planning.request", input_for_problem_planning[0]['content'], example=example_no)
+
+        planning, pr_tok_1, com_tok_1 = self.stage_chat(
+            "planning",
+            input_for_problem_planning
+        )
+        api_calls += 1
+        pr_tok += pr_tok_1
+        com_tok += com_tok_1
+
+        self.log.text("planning.response", planning, example=example_no)
+
+        # 计划验证
+        input_for_planning_verification = [
+            {
+                "role": "user",
+                "content": f"""{shared_prefix}Evaluate the following plan for solving the problem above. Provide a confidence score (0-100) and explain your reasoning.
+# Proposed Plan:
+{planning}
+
+# Evaluation Criteria:
+1. Completeness: Does the plan cover all aspects of the problem?
+2. Correctness: Is the algorithmic approach sound?
+3. Feasibility: Can the plan be implemented effectively?
+4. Edge Cases: Does the plan consider boundary conditions?
+5. Efficiency: Does the plan consider time and space complexity?
+
+# Your Response:
+<root>
+<analysis>
+# Detailed analysis of the plan's strengths and weaknesses
+</analysis>
+<confidence>
+# Confidence score (0-100 integer) based on the above criteria
+</confidence>
 </root>
-""",
-            },
+"""
+            }
         ]
 
-        print("\n\n________________________")
-        print("Input for knowledge base and exemplars: ")
-        print(input_kb_exemplars[0]['content'], flush=True)
+        self.log.text("verification.request", input_for_planning_verification[0]['content'], example=example_no)
 
-        response, pr_tok, com_tok = self.gpt_chat(
-            processed_input=input_kb_exemplars
+        verification_res, pr_tok_1, com_tok_1 = self.stage_chat(
+            "verification",
+            input_for_planning_verification
         )
-        item['api_calls'] = item.get('api_calls', 0) + 1
+        api_calls += 1
+        pr_tok += pr_tok_1
+        com_tok += com_tok_1
 
-        # 后处理
-        response = self.replace_tag(response, 'algorithm')
-        response = self.replace_tag(response, 'description')
-        response = self.replace_tag(response, 'code')
-        response = self.replace_tag(response, 'planning')
-        response = self.replace_tag(response, 'techniques')
-        response = self.replace_tag(response, 'learned_techniques')
+        verification_res = self.parse_xml(verification_res)
 
-        print("\n\n________________________")
-        print("Response from knowledge base and exemplars: ")
-        print(response, flush=True)
 
-        response = self.parse_xml(response)
+        confidence_score = 0
+        try:
+            confidence_text = verification_res.get('confidence', '0')
+            confidence_score = int(re.search(r'\d+', confidence_text).group())
+            confidence_score = max(0, min(100, confidence_score))
+        except:
+            confidence_score = 50  # 默认值
 
+        self.log.text("verification.analysis", str(verification_res.get('analysis', '')), example=example_no)
+        self.log.event("verification.done", example=example_no, confidence=confidence_score)
 
-        problems = response.get("problem", [])
-        if not isinstance(problems, list):
-            problems = [problems]
+        return planning, confidence_score, example, pr_tok, com_tok, api_calls
 
-        algorithm_prompt = f"## Relevant Algorithm: {response.get('algorithm', '')}"
-        learned_techniques = f"## Learned Code Generation Techniques: {response.get('learned_techniques', '')}"
-        sample_io_prompt = f"## Sample Test cases: \n{self.get_sample_io_str(item['sample_io'])}\n"
+    def solve_with_plan(
+            self,
+            item: dict,
+            planning: str,
+            response,
+            shared_prefix: str,
+            std_input_prompt: str,
+            cancel: threading.Event = None,
+    ):
+        """
+        Generates code for one plan and debugs it for up to `t` rounds.
+        Returns the final code, whether it passed the sample tests, the last
+        model response and the tokens and api calls spent. Setting `cancel`
+        stops the chain before its next model call.
+        """
+        pr_tok, com_tok, api_calls = 0, 0, 0
+        budget = self.item_budget()
+
+        if cancel is not None and cancel.is_set():
+            return "", False, response, pr_tok, com_tok, api_calls
+
+        input_for_final_code_generation = [
+            {
+                "role": "user",
+                "content": f"""{shared_prefix}Generate {self.language} code to solve the problem above based on the provided plan.
+# Planning:
+{planning}
 
-        plannings = []
-        for example_no, example in enumerate(problems, start=1):
-            # 确保示例是字典格式
-            if isinstance(example, str):
-                example = {"description": example, "code": "", "planning": "", "techniques": ""}
+# Instructions:
+1. Implement the solution exactly as per the planning
+2. Add comments to explain key steps
+3. Handle edge cases appropriately
+4. {std_input_prompt}
+
+# Your Response:
+Generate only the {self.language} code. Do not include any explanations.
+"""
+            }
+        ]
+
+        self.log.text("coding.request", input_for_final_code_generation[0]['content'])
 
-            example_problem = example.get("description", "")
-            example_planning = example.get("planning", "")
-            example_techniques = example.get("techniques", "")
+        code, pr_tok_1, com_tok_1 = self.stage_chat(
+            "coding",
+            input_for_final_code_generation
+        )
+        api_calls += 1
+        code = self.parse_code(code)
+        pr_tok += pr_tok_1
+        com_tok += com_tok_1
+
+        self.log.text("coding.response", code)
+
+        # 4. 增强调试智能体：提供更详细的错误分析
+        response_record = f"## Planning: {planning}\n## Code:\n```\n{code}\n```"
+        passed = False
+        previous_code = ""
+        seen = set()
+        debug_overrides = {}
+
+        for i in range(1, self.t + 1):
+            passed, test_log = self.evaluate_sample_io(item, code)
+
+            if passed or (cancel is not None and cancel.is_set()):
+                break
 
-            # 2. 增强计划智能体：生成更详细的计划
-            input_for_problem_planning = [
+            reason = budget.exhausted()
+            if reason is not None:
+                budget.skip(self.t - i + 1, reason)
+                break
+
+            fingerprint = code_fingerprint(code, self.language)
+            if fingerprint in seen and self.on_cycle is not None:
+                if self.on_cycle == "temperature" and "temperature" not in debug_overrides:
+                    params = getattr(self.model, "model_params", {})
+                    temperature = self.stage_params.get("debugging", {}).get("temperature", params.get("temperature") or 0)
+                    debug_overrides["temperature"] = min(1.0, temperature + 0.5)
+                    self.log.event("debugging.cycle", round=i, action="temperature", temperature=debug_overrides["temperature"])
+                else:
+                    # The same candidate again: the remaining rounds would repeat it
+                    budget.skip(self.t - i + 1, "cycle")
+                    self.log.event("debugging.cycle", round=i, action="next_plan")
+                    break
+            seen.add(fingerprint)
+
+            history = f"{response}\n## Test Report:\n{test_log}"
+            if self.debug_context is not None:
+                full_tokens = self.debug_context.tokens(history)
+                history = self.debug_context.build(code, previous_code, test_log)
+                context_tokens = self.debug_context.tokens(history)
+                self.log.event(
+                    "debugging.round", round=i, test_log_chars=len(test_log),
+                    context_tokens=context_tokens, saved_prompt_tokens=full_tokens - context_tokens,
+                )
+            else:
+                self.log.event("debugging.round", round=i, test_log_chars=len(test_log))
+
+            input_for_improving_code = [
                 {
                     "role": "user",
-                    "content": f"""Given a competitive programming problem, generate a detailed, step-by-step plan to solve it.
-# Example Problem:
-{example_problem}
+                    "content": f"{shared_prefix}For the competitive programming problem above you have generated {self.language} code to solve the problem. But the generated code can not pass sample test cases. Improve your code to solve the problem correctly.\n{history}\n## Modified Planning:\n## Let's think step by step to modify {self.language} Code for solving this problem.\n\n----------------\nImportant:\n{std_input_prompt}\n## Your response must contain the modified planning and then the {self.language} code inside ``` block to solve this problem."
+                }
+            ]
 
-# Example Techniques:
-{example_techniques}
+            self.log.text("debugging.request", input_for_improving_code[0]['content'], round=i)
 
-# Example Planning:
-{example_planning}
+            response, pr_tok_1, com_tok_1 = self.stage_chat(
+                "debugging",
+                input_for_improving_code,
+                **debug_overrides
+            )
+            api_calls += 1
+            # time.sleep(1)
 
-# Algorithm:
-{algorithm_prompt}
+            previous_code = code
+            code = self.parse_code(response)
+            pr_tok += pr_tok_1
+            com_tok += com_tok_1
 
-# Learned Techniques:
-{learned_techniques}
+            self.log.text("debugging.response", response, round=i)
 
-# Problem to Solve:
-{self.data.get_prompt(item)}
+        return code, passed, response, pr_tok, com_tok, api_calls
 
-# Sample Test Cases:
-{sample_io_prompt}
+    def speculate(
+            self,
+            item: dict,
+            plannings: list,
+            response,
+            *code_args,
+    ):
+        """
+        Runs `solve_with_plan` for several plans concurrently and cancels the
+        others as soon as one passes the sample tests. Work already in
+        flight when the winner arrives is drained so token accounting stays
+        exact. Returns the winning (or, if none passed, the lowest-ranked)
+        outcome plus the tokens spent by the discarded chains.
+        """
+        cancel = threading.Event()
+        outcomes = [None] * len(plannings)
+        winner = None
+
+        with ThreadPoolExecutor(max_workers=len(plannings)) as pool:
+            futures = {
+                self.submit(pool, self.solve_with_plan, item, planning, response, *code_args, cancel=cancel): rank
+                for rank, (planning, confidence, example) in enumerate(plannings)
+            }
+            for future in as_completed(futures):
+                rank = futures[future]
+                outcomes[rank] = future.result()
+                if outcomes[rank][1] and winner is None:
+                    winner = rank
+                    cancel.set()
+
+        chosen = winner if winner is not None else len(plannings) - 1
+        pr_tok = sum(outcome[3] for outcome in outcomes)
+        com_tok = sum(outcome[4] for outcome in outcomes)
+        api_calls = sum(outcome[5] for outcome in outcomes)
+        wasted_tokens = sum(
+            outcome[3] + outcome[4]
+            for rank, outcome in enumerate(outcomes)
+            if rank != chosen
+        )
+
+        code, passed, response = outcomes[chosen][:3]
+        return code, passed, response, pr_tok, com_tok, api_calls, wasted_tokens
+
+    def plan_chain(self, item: dict, plan_args: tuple):
+        """
+        `plan_with_exemplar` guarded by the item budget: returns None without
+        calling the model once a plan reached the confidence threshold or
+        the budget is spent. The first exemplar is always planned, so the
+        pass has at least one plan to code.
+        """
+        budget = self.item_budget()
+        reason = budget.planning_stop() if plan_args[0] > 1 else None
+        if reason is not None:
+            budget.skip(2, reason)
+            return None
+
+        chain = self.plan_with_exemplar(item, *plan_args)
+        budget.observe_confidence(chain[1])
+        return chain
+
+    @staticmethod
+    def split_tokens(total: int, weights: list) -> list:
+        """Splits the tokens of a shared request over its parts, by weight"""
+        if not any(weights):
+            weights = [1] * len(weights)
+        shares = [total * weight // sum(weights) for weight in weights]
+        shares[0] += total - sum(shares)
+        return shares
+
+    def plan_multi_sample(self, item: dict, problems: list, shared_prefix: str):
+        """
+        Samples one plan per exemplar from a single planning request with
+        `n` choices, then scores all plans in a single verification
+        request. Returns chains shaped like those of `plan_with_exemplar`.
+        The prompt tokens of each request are sent and billed once and are
+        split evenly over the plans; completion tokens are split by the
+        length of each plan. The api calls (one per planning request, which
+        is one per plan for models without native `n`, plus the
+        verification) are attributed to the first chain.
+        """
+        # Always sent, even on a spent budget: it yields the only plans of
+        # the pass
+        budget = self.item_budget()
+
+        examples = [
+            example if isinstance(example, dict)
+            else {"description": example, "code": "", "planning": "", "techniques": ""}
+            for example in problems
+        ]
+        example_prompt = "\n".join(
+            f"""## Example {example_no}:
+{example.get("description", "")}
+### Techniques:
+{example.get("techniques", "")}
+### Planning:
+{example.get("planning", "")}
+"""
+            for example_no, example in enumerate(examples, start=1)
+        )
 
+        input_for_problem_planning = [
+            {
+                "role": "user",
+                "content": f"""{shared_prefix}Given the competitive programming problem above, generate a detailed, step-by-step plan to solve it.
+# Example Problems:
+{example_prompt}
 # Detailed Planning:
 Create a detailed, step-by-step plan to solve the problem. Structure your plan as:
 1. Step 1: [Description of first step]
@@ -239,35 +624,26 @@ Important:
 - Include time and space complexity considerations
 - Do not generate code, only the planning
 """
-                }
-            ]
-
-            print("\n\n________________________")
-            print(f"Input for our problem planning using example: {example_no}: ")
-            print(input_for_problem_planning[0]['content'], flush=True)
-
-            planning, pr_tok_1, com_tok_1 = self.gpt_chat(
-                input_for_problem_planning
-            )
-            item['api_calls'] += 1
-            pr_tok += pr_tok_1
-            com_tok += com_tok_1
-
-            print("\n\n________________________")
-            print("Response from our problem planning: ")
-            print(planning, flush=True)
+            }
+        ]
 
-            # 计划验证
-            input_for_planning_verification = [
-                {
-                    "role": "user",
-                    "content": f"""Evaluate the following plan for solving the problem. Provide a confidence score (0-100) and explain your reasoning.
-# Problem:
-{self.data.get_prompt(item)}
+        self.log.text("planning.request", input_for_problem_planning[0]['content'], samples=len(examples))
 
-# Proposed Plan:
-{planning}
+        plannings, plan_pr_tok, plan_com_tok, plan_calls = self.stage_chat(
+            "planning",
+            input_for_problem_planning,
+            n=len(examples)
+        )
 
+        plans_prompt = "\n".join(
+            f"# Plan {plan_no}:\n{planning}\n"
+            for plan_no, planning in enumerate(plannings, start=1)
+        )
+        input_for_planning_verification = [
+            {
+                "role": "user",
+                "content": f"""{shared_prefix}Evaluate each of the following {len(plannings)} plans for solving the problem above. For every plan provide a confidence score (0-100) and explain your reasoning.
+{plans_prompt}
 # Evaluation Criteria:
 1. Completeness: Does the plan cover all aspects of the problem?
 2. Correctness: Is the algorithmic approach sound?
@@ -276,154 +652,273 @@ Important:
 5. Efficiency: Does the plan consider time and space complexity?
 
 # Your Response:
+One <analysis> and <confidence> pair per plan, in the order of the plans:
 <root>
 <analysis>
-# Detailed analysis of the plan's strengths and weaknesses
+# Detailed analysis of Plan 1's strengths and weaknesses
 </analysis>
 <confidence>
-# Confidence score (0-100 integer) based on the above criteria
+# Confidence score of Plan 1 (0-100 integer) based on the above criteria
 </confidence>
+...
 </root>
 """
-                }
-            ]
+            }
+        ]
 
-            print("Input for planning verification: ")
-            print(input_for_planning_verification[0]['content'], flush=True)
+        self.log.text("verification.request", input_for_planning_verification[0]['content'], samples=len(plannings))
 
-            verification_res, pr_tok_1, com_tok_1 = self.gpt_chat(
-                input_for_planning_verification
+        verification_res, verify_pr_tok, verify_com_tok = self.stage_chat(
+            "verification",
+            input_for_planning_verification
+        )
+        verification_res = self.parse_xml(verification_res)
+
+        confidences = verification_res.get('confidence', [])
+        if not isinstance(confidences, list):
+            confidences = [confidences]
+
+        lengths = [len(planning) for planning in plannings]
+        pr_toks = self.split_tokens(plan_pr_tok + verify_pr_tok, [1] * len(plannings))
+        com_toks = [
+            plan + verify
+            for plan, verify in zip(
+                self.split_tokens(plan_com_tok, lengths),
+                self.split_tokens(verify_com_tok, [1] * len(plannings)),
             )
-            item['api_calls'] += 1
-            pr_tok += pr_tok_1
-            com_tok += com_tok_1
-
-            verification_res = self.replace_tag(verification_res, 'analysis')
-            verification_res = self.replace_tag(verification_res, 'confidence')
-            verification_res = self.parse_xml(verification_res)
-
+        ]
 
-            confidence_score = 0
+        chains = []
+        for i, planning in enumerate(plannings):
             try:
-                confidence_text = verification_res.get('confidence', '0')
-                confidence_score = int(re.search(r'\d+', confidence_text).group())
+                confidence_score = int(re.search(r'\d+', confidences[i]).group())
                 confidence_score = max(0, min(100, confidence_score))
             except:
                 confidence_score = 50  # 默认值
 
-            print("Response from planning verification: ")
-            print(f"Analysis: {verification_res.get('analysis', '')}")
-            print(f"Confidence: {confidence_score}")
-
-            plannings.append((
-                planning,
-                confidence_score,
-                example
-            ))
-
-        # 按置信度排序计划
-        plannings.sort(key=lambda x: x[1], reverse=True)
+            self.log.event("verification.done", example=i + 1, confidence=confidence_score)
+            budget.observe_confidence(confidence_score)
+            chains.append((planning, confidence_score, examples[i], pr_toks[i], com_toks[i], plan_calls + 1 if i == 0 else 0))
+        return chains
 
-        # 标准输入/输出提示
-        if type(self.data) in [APPSDataset]:
-            std_input_prompt = "## Note: Strictly follow the input and output format. Take input from stdin and output to stdout. If writing a function, after the function definition, take input using `input()`, call the function, and print the result. Avoid extra print statements."
-        else:
-            std_input_prompt = ""
+    def run_single_pass(self, item: dict):
+        task_id = item.get(getattr(self.data, "id_key", "task_id"))
+        cid = f"{task_id}-{uuid.uuid4().hex[:8]}"
+        correlation_id.set(cid)
+        route_key.set(str(task_id))
+        self.log.event("pass.start", task_id=task_id)
+
+        budget = self.budget.start()
+        current_budget.set(budget)
+
+        checkpoint = None
+        if self.checkpoints is not None:
+            checkpoint = self.checkpoints.start(task_id, item.get('no_of_try', 0))
+        current_checkpoint.set(checkpoint)
+        current_memo.set(self.eval_memo or EvaluationMemo())
+
+        with self.instrumentation.span("pass", task_id=str(task_id)):
+            code, pr_tok, com_tok = self.run_pipeline(item)
+
+        if checkpoint is not None:
+            if checkpoint.replayed:
+                self.log.event("checkpoint.replayed", stages=checkpoint.replayed)
+            self.checkpoints.release(checkpoint.pass_key)
+
+        item['saved_api_calls'] = item.get('saved_api_calls', 0) + budget.saved_calls
+        # Prompt tokens of this pass served from the provider's prompt cache,
+        # alongside the per-pass `prompt_tokens` kept by the runner
+        item.setdefault('cached_prompt_tokens', []).append(budget.cached_tokens)
+        if budget.saved_calls:
+            self.log.event("budget.saved", **budget.summary())
+
+        # Per-stage time/token totals of this pass are stored with the result
+        summary = self.instrumentation.pop_summary(cid)
+        if summary is not None:
+            item.setdefault('stage_metrics', []).append(summary)
 
-        # 3. 代码生成智能体（保持原有结构但优化提示词）
-        for planning_with_ex in plannings:
-            planning, confidence, example = planning_with_ex
+        return code, pr_tok, com_tok
 
-            input_for_final_code_generation = [
-                {
-                    "role": "user",
-                    "content": f"""Generate {self.language} code to solve the following problem based on the provided plan.
+    def run_pipeline(self, item: dict):
+        # 1. 增强检索智能体：学习代码生成技巧
+        input_kb_exemplars = [
+            {
+                "role": "user",
+                "content": f"""Given a problem, provide relevant problems and learn code generation techniques from them. Also identify the algorithm behind the problem and explain its tutorial.
 # Problem:
 {self.data.get_prompt(item)}
 
-# Planning:
-{planning}
+# Exemplars:
+Recall {self.k} relevant and distinct problems (different from the given problem). For each problem:
+1. Describe it concisely
+2. Generate {self.language} code step by step to solve that problem
+3. Analyze and extract 1-3 key code generation techniques used in the solution
+4. Generate a detailed planning to solve that problem
 
-# Sample Test Cases:
-{sample_io_prompt}
+# Algorithm:
 
-# Learned Techniques:
-{learned_techniques}
+----------------
+Important:
+Your response must follow the following xml format:
 
-# Algorithm:
-{algorithm_prompt}
+<root>
+<problem>
+<description>
+# Describe the problem concisely.
+</description>
+<code>
+# Let's think step by step to solve this problem in {self.language} programming language.
+</code>
+<techniques>
+# Extract 1-3 key code generation techniques used in this solution.
+</techniques>
+<planning>
+# Detailed planning to solve this problem.
+</planning>
+</problem>
 
-# Instructions:
-1. Implement the solution exactly as per the planning
-2. Add comments to explain key steps
-3. Handle edge cases appropriately
-4. {std_input_prompt}
+# Add more problems here...
 
-# Your Response:
-Generate only the {self.language} code. Do not include any explanations.
-"""
-                }
-            ]
+<algorithm>
+# Identify the algorithm (Brute-force, Dynamic Programming, Divide-and-conquer, Greedy, Backtracking, Recursive, Binary search, etc.) that needs to be used to solve the original problem.
+# Write a useful tutorial about the identified algorithm. Provide a high-level generic tutorial for solving this type of problem. Do not generate code.
+</algorithm>
 
-            print("\n\n________________________")
-            print("Input for final code generation: ")
-            print(input_for_final_code_generation[0]['content'], flush=True)
+<learned_techniques>
+# Summarize the key code generation techniques learned from all the examples (3-5 techniques).
+</learned_techniques>
+</root>
+""",
+            },
+        ]
+
+        memory = self.retrieval_memory
+        problem_text = self.data.get_prompt(item)
+        memory_tag = f"{self.language}/k={self.k}"
+        memory_key = item.get(getattr(self.data, "id_key", "task_id"))
+        remembered = memory.lookup(problem_text, memory_tag, memory_key) if memory is not None else None
+
+        if remembered is not None:
+            response, similarity, saved_tokens = remembered
+            pr_tok, com_tok = 0, 0
+            item.setdefault('api_calls', 0)
+            self.item_budget().skip(1, "retrieval_memory")
+            self.log.event("retrieval.memory_hit", similarity=round(similarity, 3), saved_tokens=saved_tokens)
+        else:
+            self.log.text("retrieval.request", input_kb_exemplars[0]['content'])
 
-            code, pr_tok_1, com_tok_1 = self.gpt_chat(
-                input_for_final_code_generation
+            response, pr_tok, com_tok = self.stage_chat(
+                "retrieval",
+                input_kb_exemplars
             )
-            item['api_calls'] += 1
-            code = self.parse_code(code)
+            item['api_calls'] = item.get('api_calls', 0) + 1
+
+            self.log.text("retrieval.response", response)
+
+            response = self.parse_xml(response)
+            # A response without exemplars is not worth serving again
+            if memory is not None and response.get("problem"):
+                memory.add(problem_text, response, pr_tok + com_tok, memory_tag, key=memory_key)
+
+
+        problems = response.get("problem", [])
+        if not isinstance(problems, list):
+            problems = [problems]
+
+        algorithm_prompt = f"## Relevant Algorithm: {response.get('algorithm', '')}"
+        learned_techniques = f"## Learned Code Generation Techniques: {response.get('learned_techniques', '')}"
+        sample_io_prompt = f"## Sample Test cases: \n{self.get_sample_io_str(item['sample_io'])}\n"
+
+        shared_prefix = self.shared_prefix(item, algorithm_prompt, learned_techniques, sample_io_prompt)
+
+        plan_args = [
+            (example_no, example, shared_prefix)
+            for example_no, example in enumerate(problems, start=1)
+        ]
+        with self.instrumentation.span("stage.planning", exemplars=len(plan_args)):
+            # The k planning -> verification chains are independent until sorting
+            if self.multi_sample and len(problems) > 1:
+                chains = self.plan_multi_sample(item, problems, shared_prefix)
+            elif self.plan_concurrency > 1 and len(plan_args) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.plan_concurrency, len(plan_args))) as pool:
+                    futures = [self.submit(pool, self.plan_chain, item, args) for args in plan_args]
+                    chains = [future.result() for future in futures]
+            else:
+                chains = [self.plan_chain(item, args) for args in plan_args]
+
+        plannings = []
+        for chain in chains:
+            if chain is None:
+                continue
+            planning, confidence_score, example, pr_tok_1, com_tok_1, api_calls = chain
+            item['api_calls'] += api_calls
             pr_tok += pr_tok_1
             com_tok += com_tok_1
+            plannings.append((
+                planning,
+                confidence_score,
+                example
+            ))
 
-            print("\n\n________________________")
-            print("Response from final code generation: ")
-            print(code, flush=True)
+        # 按置信度排序计划
+        plannings.sort(key=lambda x: x[1], reverse=True)
 
-            # 4. 增强调试智能体：提供更详细的错误分析
-            response_record = f"## Planning: {planning}\n## Code:\n```\n{code}\n```"
-            passed = False
+        budget = self.item_budget()
+        if self.budget.min_confidence is not None and len(plannings) > 1:
+            kept = [plannings[0]] + [p for p in plannings[1:] if p[1] >= self.budget.min_confidence]
+            budget.skip((len(plannings) - len(kept)) * (1 + self.t), "low_confidence")
+            plannings = kept
 
-            for i in range(1, self.t + 1):
-                passed, test_log = self.data.evaluate_sample_io(
-                    item,
-                    code,
-                    self.language
+        # 标准输入/输出提示
+        if type(self.data) in [APPSDataset]:
+            std_input_prompt = "## Note: Strictly follow the input and output format. Take input from stdin and output to stdout. If writing a function, after the function definition, take input using `input()`, call the function, and print the result. Avoid extra print statements."
+        else:
+            std_input_prompt = ""
+
+        code_args = (shared_prefix, std_input_prompt)
+
+        # 3. 代码生成智能体（保持原有结构但优化提示词）
+        with self.instrumentation.span("stage.coding", plans=len(plannings)) as span:
+            code = ""
+            passed = False
+            speculated = False
+            if self.speculative_plans > 1 and len(plannings) > 1:
+                speculated = True
+                speculative = plannings[:self.speculative_plans]
+                plannings = plannings[self.speculative_plans:]
+                code, passed, response, pr_tok_1, com_tok_1, api_calls, wasted_tokens = self.speculate(
+                    item, speculative, response, *code_args
                 )
+                item['api_calls'] += api_calls
+                item['speculative_wasted_tokens'] = item.get('speculative_wasted_tokens', 0) + wasted_tokens
+                pr_tok += pr_tok_1
+                com_tok += com_tok_1
 
+            for rank, (planning, confidence, example) in enumerate(plannings):
+                # got a code that passed all sample test cases
                 if passed:
                     break
 
-                print(f"Input for improving code generation: {i}")
-                input_for_improving_code = [
-                    {
-                        "role": "user",
-                        "content": f"Given a competitive programming problem you have generated {self.language} code to solve the problem. But the generated code can not pass sample test cases. Improve your code to solve the problem correctly.\n{algorithm_prompt}\n## Problem to be solved:\n{self.data.get_prompt(item)}\n{response}\n## Test Report:\n{test_log}\n## Modified Planning:\n## Let's think step by step to modify {self.language} Code for solving this problem.\n\n----------------\nImportant:\n{std_input_prompt}\n## Your response must contain the modified planning and then the {self.language} code inside ``` block to solve this problem."
-                    }
-                ]
-
-                print("\n\n________________________")
-                print("Input for improving code generation: ")
-                print(input_for_improving_code[0]['content'], flush=True)
+                # The best plan always gets code (unless speculation already
+                # tried it); the budget cuts the rest
+                reason = budget.exhausted() if rank > 0 or speculated else None
+                if reason is not None:
+                    budget.skip((len(plannings) - rank) * (1 + self.t), reason)
+                    break
 
-                response, pr_tok_1, com_tok_1 = self.gpt_chat(
-                    input_for_improving_code
+                code, passed, response, pr_tok_1, com_tok_1, api_calls = self.solve_with_plan(
+                    item, planning, response, *code_args
                 )
-                item['api_calls'] += 1
-                # time.sleep(1)
-
-                code = self.parse_code(response)
+                item['api_calls'] += api_calls
                 pr_tok += pr_tok_1
                 com_tok += com_tok_1
-
-                print("\n\n________________________")
-                print("Response from improving code generation: ")
-                print(response, flush=True)
-
-            # got a code that passed all sample test cases
-            if passed:
-                break
-
-        print("________________________\n\n", flush=True)
+            span.set(passed=passed)
+
+        self.log.event(
+            "pass.done",
+            passed=passed,
+            api_calls=item['api_calls'],
+            prompt_tokens=pr_tok,
+            completion_tokens=com_tok,
+        )
         return code, pr_tok, com_tok
@@ -0,0 +1,102 @@
+import time
+import threading
+import contextvars
+
+
+# Budget of the pass running in the current thread / task
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+
+class ItemBudget(object):
+    """
+    Spend of one pass over one item, checked by the strategy before every
+    model call it could skip. Skipped calls are counted in `saved_calls`.
+    """
+
+    def __init__(self, controller: "BudgetController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.tokens = 0
+        self.cached_tokens = 0
+        self.best_confidence = None
+        self.saved_calls = 0
+        self.stops = {}
+        self._lock = threading.Lock()
+
+    def charge(self, tokens: int, cached_tokens: int = 0):
+        with self._lock:
+            self.tokens += tokens
+            self.cached_tokens += cached_tokens
+
+    def observe_confidence(self, confidence: int):
+        with self._lock:
+            if self.best_confidence is None or confidence > self.best_confidence:
+                self.best_confidence = confidence
+
+    def skip(self, calls: int, reason: str):
+        if calls <= 0:
+            return
+        with self._lock:
+            self.saved_calls += calls
+            self.stops[reason] = self.stops.get(reason, 0) + calls
+
+    def exhausted(self):
+        """Returns "tokens" or "time" once a limit is reached, else None"""
+        controller = self.controller
+        if controller.max_tokens is not None and self.tokens >= controller.max_tokens:
+            return "tokens"
+        if controller.max_seconds is not None and time.monotonic() - self.started >= controller.max_seconds:
+            return "time"
+        return None
+
+    def planning_stop(self):
+        """Reason to stop planning/verifying the remaining exemplars, if any"""
+        threshold = self.controller.confidence_threshold
+        if threshold is not None and self.best_confidence is not None and self.best_confidence >= threshold:
+            return "confident"
+        return self.exhausted()
+
+    def summary(self) -> dict:
+        return {
+            "tokens": self.tokens,
+            "cached_prompt_tokens": self.cached_tokens,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "saved_api_calls": self.saved_calls,
+            "stops": dict(self.stops),
+        }
+
+
+class BudgetController(object):
+    """
+    Per-item limits for the exemplar / plan / debug search of Blueprint2Code.
+
+    Arguments
+    ---------
+    max_tokens : int
+        Prompt + completion tokens after which no new model call is started
+    max_seconds : float
+        Wall-clock time after which no new model call is started
+    confidence_threshold : int
+        Stop planning and verifying the remaining exemplars once a plan is
+        verified with at least this confidence
+    min_confidence : int
+        Skip ranked plans verified below this confidence; the best plan is
+        always tried
+
+    With every limit left at `None` the search is unchanged.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = None,
+        max_seconds: float = None,
+        confidence_threshold: int = None,
+        min_confidence: int = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.confidence_threshold = confidence_threshold
+        self.min_confidence = min_confidence
+
+    def start(self) -> ItemBudget:
+        return ItemBudget(self)
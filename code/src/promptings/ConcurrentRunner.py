@@ -0,0 +1,129 @@
+import copy
+import time
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class ConcurrentRunner(object):
+    """
+    Runs `strategy.run_single_pass` for several items at once.
+
+    Every item is deep-copied before it is handed to a worker thread, so
+    per-item state such as `item['api_calls']` and the token lists never
+    leaks between items. Finished items are buffered and written to
+    `strategy.results` strictly in dataset order, so the result file is
+    identical to the one produced by the sequential `run`.
+
+    Usage
+    -----
+    ConcurrentRunner(strategy, concurrency=16).run()
+    """
+
+    def __init__(
+        self,
+        strategy,
+        concurrency: int = 8,
+        max_tries: int = 10,
+        retry_delay: float = 5,
+        max_buffered: int = None,
+    ):
+        self.strategy = strategy
+        self.concurrency = max(1, concurrency)
+        self.max_tries = max(1, max_tries)
+        self.retry_delay = retry_delay
+        # Bounds how far workers may run ahead of the next result to write
+        self.max_buffered = max_buffered or 2 * self.concurrency
+
+    def new_item(self, item: dict) -> dict:
+        item = copy.deepcopy(item)
+        item["source_codes"] = []
+        item["responses"] = []
+        item["prompt_tokens"] = []
+        item["completion_tokens"] = []
+        item["no_of_try"] = 0
+        return item
+
+    def run_with_retries(self, item: dict):
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                return self.strategy.run_single_pass(item)
+            except Exception:
+                if attempt == self.max_tries:
+                    raise
+                time.sleep(self.retry_delay)
+
+    def solve_item(self, item: dict) -> dict:
+        strategy = self.strategy
+        is_solved = False
+        cur_pass = 0
+
+        while cur_pass < strategy.pass_at_k and not is_solved:
+            response, prompt_tokens, completion_tokens = self.run_with_retries(item)
+
+            if hasattr(strategy, "parse_code"):
+                cur_imp = strategy.parse_code(response)
+            else:
+                cur_imp = response
+
+            item["source_codes"].append(cur_imp)
+            item["responses"].append(response)
+            item["prompt_tokens"].append(prompt_tokens)
+            item["completion_tokens"].append(completion_tokens)
+            item["no_of_try"] += 1
+
+            is_solved = strategy.data.evaluate(
+                item=item,
+                cur_imp=cur_imp,
+                language=strategy.language
+            )
+            cur_pass += 1
+
+        item["is_solved"] = is_solved
+        return item
+
+    def run(self):
+        strategy = self.strategy
+        results = strategy.results
+        num_items = len(strategy.data)
+        num_success = 0
+
+        # Items already present in the results are not run again
+        next_to_write = len(results)
+        for i in range(next_to_write):
+            num_success += int(bool(results[i].get("is_solved", False)))
+
+        pending = {}
+        finished = {}
+        items = enumerate(strategy.data)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            def fill():
+                while len(pending) + len(finished) < self.max_buffered:
+                    try:
+                        i, item = next(items)
+                    except StopIteration:
+                        return
+                    if i < next_to_write:
+                        continue
+                    future = pool.submit(self.solve_item, self.new_item(item))
+                    pending[future] = i
+
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[pending.pop(future)] = future.result()
+
+                while next_to_write in finished:
+                    item = finished.pop(next_to_write)
+                    results.add_result(item)
+                    num_success += int(item["is_solved"])
+                    next_to_write += 1
+
+                    if getattr(strategy, "verbose", True):
+                        print(f'completed {next_to_write}/{num_items}, Solved: {item["is_solved"]}, number of success = {num_success}/{next_to_write}, acc = {round(num_success/next_to_write*100, 2)}', flush=True)
+
+                fill()
+
+        results.save_results()
+        return num_success
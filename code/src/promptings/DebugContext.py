@@ -0,0 +1,74 @@
+import difflib
+
+from utils.token_count import string_token_count, truncate_to_tokens
+
+
+class DebugContext(object):
+    """
+    Builds the history part of a debugging prompt within a token budget.
+
+    Instead of the whole previous response and test report, a round shows
+    the current code, its diff from the previous attempt, the first
+    failing test case and the test report, filled in that order of
+    priority until `max_tokens` is reached. The code is always kept whole;
+    the other parts are truncated or dropped, and the test report never
+    takes more than `max_log_tokens`.
+
+    Arguments
+    ---------
+    max_tokens : int
+        Token budget of the whole history
+    max_log_tokens : int
+        Token budget of the test report
+    model : str
+        Model whose tokenizer measures the budget; the strategy fills in
+        its own model when left unset
+    """
+
+    def __init__(self, max_tokens: int = 2000, max_log_tokens: int = 400, model: str = None):
+        self.max_tokens = max_tokens
+        self.max_log_tokens = max_log_tokens
+        self.model = model
+
+    @staticmethod
+    def first_failure(test_log: str) -> str:
+        """The report of the first failing test case, if it can be found"""
+        start = test_log.find("failed in test case")
+        if start < 0:
+            return ""
+        end = test_log.find("passed in test case", start + 1)
+        failure_end = test_log.find("failed in test case", start + 1)
+        ends = [e for e in (end, failure_end) if e >= 0]
+        return test_log[start:min(ends) if ends else len(test_log)].strip()
+
+    def build(self, code: str, previous_code: str, test_log: str) -> str:
+        count = lambda text: string_token_count(text, self.model)
+
+        sections = [f"## Current Code:\n```\n{code}\n```"]
+        remaining = self.max_tokens - count(sections[0])
+
+        if previous_code and previous_code != code and remaining > 0:
+            diff = "\n".join(difflib.unified_diff(
+                previous_code.splitlines(), code.splitlines(),
+                "previous", "current", n=1, lineterm="",
+            ))
+            section = "## Changes From The Previous Attempt:\n```diff\n" + truncate_to_tokens(diff, remaining - 12, self.model) + "\n```"
+            if remaining - 12 > 0:
+                sections.append(section)
+                remaining -= count(section)
+
+        failure = self.first_failure(test_log)
+        if failure and remaining - 8 > 0:
+            section = "## First Failing Test Case:\n" + truncate_to_tokens(failure, remaining - 8, self.model)
+            sections.append(section)
+            remaining -= count(section)
+
+        if remaining > 0:
+            log_budget = min(self.max_log_tokens, remaining - 6)
+            if log_budget > 0:
+                sections.append("## Test Report:\n" + truncate_to_tokens(test_log, log_budget, self.model))
+
+        return "\n".join(sections)
+
+    def tokens(self, text: str) -> int:
+        return string_token_count(text, self.model)
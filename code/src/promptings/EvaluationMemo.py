@@ -0,0 +1,72 @@
+import ast
+import json
+import hashlib
+import threading
+import contextvars
+
+from collections import OrderedDict
+
+
+# Memo of the pass running in the current thread / task
+current_memo = contextvars.ContextVar("current_memo", default=None)
+
+
+def code_fingerprint(code: str, language: str = "Python3") -> str:
+    """
+    Hash of a candidate that ignores formatting: the AST (without comments,
+    whitespace or positions) for Python that parses, else the code without
+    indentation, trailing whitespace and blank lines. Whitespace inside a
+    line is kept, since it may belong to a string literal.
+    """
+    normalized = None
+    if "python" in language.lower():
+        try:
+            normalized = ast.dump(ast.parse(code), annotate_fields=False)
+        except (SyntaxError, ValueError):
+            pass
+    if normalized is None:
+        normalized = "\n".join(line.strip() for line in code.splitlines() if line.strip())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class EvaluationMemo(object):
+    """
+    Sample-IO results `(passed, test_log)` keyed by the item's sample tests
+    and the fingerprint of the candidate, so a candidate that is equal to
+    an earlier one up to formatting is not run again. One memo per pass is
+    used by default; a memo handed to the strategy is shared by all items
+    and bounded to `max_entries` (least recently used first out).
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(item: dict, fingerprint: str) -> str:
+        tests = json.dumps(item.get("sample_io"), sort_keys=True, default=str)
+        return hashlib.sha1(tests.encode("utf-8")).hexdigest() + fingerprint
+
+    def get(self, key: str):
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: str, passed: bool, test_log: str):
+        with self._lock:
+            self._results[key] = (passed, test_log)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._results), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,154 @@
+import os
+import re
+import copy
+import json
+import zlib
+import threading
+
+import numpy as np
+
+
+# Mersenne prime 2^31 - 1: products of two values below it fit in uint64
+_PRIME = (1 << 31) - 1
+
+
+class RetrievalMemory(object):
+    """
+    Similarity index over the parsed retrieval outputs (exemplars,
+    algorithm tutorial, learned techniques) of past items.
+
+    Problems are compared by MinHash signatures of their word shingles, an
+    estimate of their Jaccard similarity. `lookup` returns a copy of the
+    stored retrieval dict of the most similar past problem once the
+    estimate reaches `threshold`, so near-duplicate problems skip the
+    retrieval call. Entries are appended to a JSONL file at `path` and
+    loaded again on start.
+
+    Arguments
+    ---------
+    threshold : float
+        Minimum estimated Jaccard similarity for a hit
+    num_perm : int
+        Number of hash functions of a signature
+    shingle_size : int
+        Words per shingle
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        shingle_size: int = 3,
+        seed: int = 1,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._tags = []
+        self._keys = []
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+        self._fp = None
+        if path is not None:
+            if os.path.exists(path):
+                self._load()
+            self._fp = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        signatures = []
+        with open(self.path, encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of an interrupted write
+                    continue
+                signatures.append(entry.pop("signature"))
+                self._tags.append(entry["tag"])
+                self._keys.append(entry["key"])
+                self._entries.append(entry)
+        if signatures:
+            self._signatures = np.array(signatures, dtype=np.uint32)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower())
+        n = self.shingle_size
+        shingles = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # (num_perm, shingles) universal hashes, minimum per hash function
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, text: str, tag: str = "", key=None):
+        """
+        Returns (retrieval dict, similarity, tokens saved) of the closest
+        stored problem with the same `tag` and a different `key` (an item
+        never reuses its own retrieval), or None below the threshold
+        """
+        signature = self.signature(text)
+        with self._lock:
+            match = None
+            if self._entries:
+                similarity = (self._signatures == signature).mean(axis=1)
+                similarity[[t != tag for t in self._tags]] = -1
+                if key is not None:
+                    similarity[[k == key for k in self._keys]] = -1
+                best = int(similarity.argmax())
+                if similarity[best] >= self.threshold:
+                    match = best, float(similarity[best])
+
+            if match is None:
+                self.misses += 1
+                return None
+
+            entry = self._entries[match[0]]
+            self.hits += 1
+            self.saved_tokens += entry["tokens"]
+            return copy.deepcopy(entry["retrieval"]), match[1], entry["tokens"]
+
+    def add(self, text: str, retrieval: dict, tokens: int, tag: str = "", key=None):
+        signature = self.signature(text)
+        entry = {"key": key, "tag": tag, "tokens": tokens, "retrieval": retrieval}
+        with self._lock:
+            self._signatures = np.vstack([self._signatures, signature])
+            self._tags.append(tag)
+            self._keys.append(key)
+            self._entries.append(entry)
+            if self._fp is not None:
+                self._fp.write(json.dumps({**entry, "signature": signature.tolist()}, ensure_ascii=False) + "\n")
+                self._fp.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "lookups": lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
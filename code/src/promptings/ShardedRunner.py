@@ -0,0 +1,311 @@
+import os
+import glob
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+
+from promptings.ConcurrentRunner import ConcurrentRunner
+from results.Results import Results
+
+
+class WorkQueue(object):
+    """
+    Dataset indices shared by several worker processes through one SQLite
+    file. A worker leases an index for `lease_seconds`; a lease that is not
+    renewed (crashed or preempted worker) expires and the index is handed
+    out again. Every lease counts as an attempt. Every worker on every host
+    must see the same file with working POSIX locks (a local disk or a
+    lock-capable shared filesystem).
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # done: 0 pending, 1 finished, 2 failed for good
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "idx INTEGER PRIMARY KEY, "
+            "done INTEGER NOT NULL DEFAULT 0, "
+            "worker TEXT, "
+            "lease_until REAL NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")]
+        if "error" not in columns:
+            # Queue created before failed items were recorded
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN error TEXT")
+
+    def populate(self, size: int):
+        """Adds indices 0..size-1; existing entries keep their state"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (idx) VALUES (?)",
+                ((i,) for i in range(size)),
+            )
+            self._conn.execute("COMMIT")
+
+    def lease(self, worker: str):
+        """
+        Returns (index, attempts including this one) of the lowest index
+        that is pending and not leased, or None
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT idx, attempts FROM tasks WHERE done = 0 AND lease_until < ? ORDER BY idx LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE tasks SET worker = ?, lease_until = ?, attempts = attempts + 1 WHERE idx = ?",
+                        (worker, now + self.lease_seconds, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[0], row[1] + 1)
+
+    def renew(self, worker: str, indices: list):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE tasks SET lease_until = ? WHERE idx = ? AND worker = ? AND done = 0",
+                ((time.time() + self.lease_seconds, idx, worker) for idx in indices),
+            )
+
+    def complete(self, worker: str, idx: int):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET done = 1, worker = ? WHERE idx = ?",
+                (worker, idx),
+            )
+
+    def fail(self, worker: str, idx: int, error: str):
+        """Takes an index out of the queue for good, keeping its error"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET done = 2, worker = ?, error = ? WHERE idx = ?",
+                (worker, error, idx),
+            )
+
+    def release(self, worker: str, idx: int):
+        """Hands a failed index back without waiting for its lease to expire"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET lease_until = 0 WHERE idx = ? AND worker = ? AND done = 0",
+                (idx, worker),
+            )
+
+    def remaining(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tasks WHERE done = 0").fetchone()[0]
+
+    def failed(self) -> dict:
+        """Error of every failed index"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT idx, error FROM tasks WHERE done = 2 ORDER BY idx"))
+
+    def close(self):
+        self._conn.close()
+
+
+class ShardedRunner(object):
+    """
+    One worker of a sharded run. Any number of workers, as processes on
+    one or several hosts, share a `WorkQueue` and each writes the items it
+    solves to its own append-only shard `{shard_dir}/shard-{worker_id}.jsonl`.
+    Once the queue is drained, `merge` writes the shards into one result
+    file in dataset order.
+
+    An item that raised, or whose worker died, is handed out again until
+    it was leased `max_attempts` times. It is then marked failed in the
+    queue and written to the shard unsolved, with its last error under
+    `error`, so one poison item cannot stop the run.
+
+    Usage
+    -----
+    ShardedRunner(strategy, "run/queue.db", "run/shards").run()
+    ShardedRunner.merge(strategy.data, "run/shards", "results.jsonl")
+    """
+
+    def __init__(
+        self,
+        strategy,
+        queue_path: str,
+        shard_dir: str,
+        worker_id: str = None,
+        concurrency: int = 1,
+        lease_seconds: float = 600,
+        max_tries: int = 10,
+        retry_delay: float = 5,
+        max_attempts: int = 3,
+    ):
+        self.strategy = strategy
+        self.queue_path = queue_path
+        self.shard_dir = shard_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.id_key = getattr(strategy.data, "id_key", "task_id")
+        # Reused for the pass@k loop and per-pass retries
+        self.runner = ConcurrentRunner(strategy, max_tries=max_tries, retry_delay=retry_delay)
+
+        os.makedirs(shard_dir, exist_ok=True)
+
+    @property
+    def shard_path(self) -> str:
+        return os.path.join(self.shard_dir, f"shard-{self.worker_id}.jsonl")
+
+    def run(self) -> int:
+        """Solves leased items until the queue is drained; returns how many"""
+        queue = WorkQueue(self.queue_path, self.lease_seconds)
+        items = list(self.strategy.data)
+        queue.populate(len(items))
+
+        results = Results(self.shard_path, append_only=True, id_key=self.id_key)
+        results_lock = threading.Lock()
+        active = set()
+        stop = threading.Event()
+        solved = 0
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                with results_lock:
+                    indices = list(active)
+                if indices:
+                    queue.renew(self.worker_id, indices)
+
+        def give_up(idx: int, error: str):
+            item = self.runner.new_item(items[idx])
+            item["is_solved"] = False
+            item["error"] = error
+            with results_lock:
+                results.add_result(item)
+                results.flush()
+            queue.fail(self.worker_id, idx, error)
+            print(f'[{self.worker_id}] item {idx} failed after {self.max_attempts} attempts: {error}', flush=True)
+
+        def work():
+            nonlocal solved
+            while True:
+                leased = queue.lease(self.worker_id)
+                if leased is None:
+                    return
+                idx, attempts = leased
+                if attempts > self.max_attempts:
+                    # Earlier attempts died with their worker
+                    give_up(idx, "worker lost during every attempt")
+                    continue
+
+                with results_lock:
+                    active.add(idx)
+                try:
+                    item = self.runner.solve_item(self.runner.new_item(items[idx]))
+                except Exception as e:
+                    error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                    if attempts >= self.max_attempts:
+                        give_up(idx, error)
+                    else:
+                        queue.release(self.worker_id, idx)
+                        print(f'[{self.worker_id}] item {idx} attempt {attempts}/{self.max_attempts} failed: {error}', flush=True)
+                    continue
+                finally:
+                    with results_lock:
+                        active.discard(idx)
+
+                with results_lock:
+                    results.add_result(item)
+                    results.flush()
+                    solved += 1
+                queue.complete(self.worker_id, idx)
+
+                if getattr(self.strategy, "verbose", True):
+                    print(f'[{self.worker_id}] completed item {idx}, Solved: {item["is_solved"]}, remaining = {queue.remaining()}', flush=True)
+
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for future in [pool.submit(work) for _ in range(self.concurrency)]:
+                    future.result()
+        finally:
+            stop.set()
+            results.close()
+            queue.close()
+
+        return solved
+
+    @staticmethod
+    def merge(data, shard_dir: str, result_path: str, id_key: str = None) -> int:
+        """
+        Writes one result per item of `data`, in dataset order. An item
+        solved by more than one worker (an expired lease) takes its record
+        from the first shard in file-name order, so the merge does not
+        depend on which worker finished first. Records and items are
+        matched on `id_key`, by default the dataset's own; records without
+        it are left out and reported. Returns the number of items written.
+        """
+        id_key = id_key or getattr(data, "id_key", "task_id")
+        records = {}
+        missing = 0
+        for shard_path in sorted(glob.glob(os.path.join(shard_dir, "shard-*.jsonl"))):
+            shard = {}
+            for result in Results(shard_path, append_only=True, id_key=id_key).get_results():
+                if result.get(id_key) is None:
+                    missing += 1
+                    continue
+                # Latest record of a task within one shard
+                shard[result[id_key]] = result
+            for task_id, result in shard.items():
+                records.setdefault(task_id, result)
+        if missing:
+            print(f"merge: skipped {missing} records without `{id_key}`", flush=True)
+
+        merged = Results(result_path, discard_previous_run=True, append_only=True, flush_interval=1 << 30, id_key=id_key)
+        for item in data:
+            result = records.get(item.get(id_key))
+            if result is not None:
+                merged.add_result(result)
+        merged.close()
+        return len(merged)
+
+
+def run_local_workers(strategy_factory, queue_path: str, shard_dir: str, workers: int, **runner_kwargs):
+    """
+    Starts `workers` processes on this host, each running a `ShardedRunner`
+    around `strategy_factory()`. The factory must be importable (a
+    module-level function) since the workers are spawned, not forked.
+    Returns the exit codes of the workers.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_run_worker,
+            args=(strategy_factory, queue_path, shard_dir, f"{socket.gethostname()}-{i}"),
+            kwargs=runner_kwargs,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+def _run_worker(strategy_factory, queue_path: str, shard_dir: str, worker_id: str, **runner_kwargs):
+    ShardedRunner(strategy_factory(), queue_path, shard_dir, worker_id=worker_id, **runner_kwargs).run()
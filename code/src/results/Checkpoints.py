@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import threading
+import contextvars
+
+
+# Checkpoint of the pass running in the current thread / task
+current_checkpoint = contextvars.ContextVar("current_checkpoint", default=None)
+
+
+class PassCheckpoint(object):
+    """
+    Checkpoints of one pass over one item.
+
+    Every stage output is stored under a hash of its input and the number
+    of times that input was seen in the pass, so a rerun of the pass after
+    a crash reaches the same keys in the same order and replays the stored
+    outputs up to the point where the first run stopped.
+    """
+
+    def __init__(self, store: "CheckpointStore", task_id, pass_no: int):
+        self.store = store
+        self.task_id = task_id
+        self.pass_key = f"{task_id}/{pass_no}"
+        self.replayed = 0
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def key(self, stage: str, payload) -> str:
+        digest = hashlib.sha1(
+            json.dumps([stage, payload], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:20]
+        with self._lock:
+            occurrence = self._seen.get(digest, 0)
+            self._seen[digest] = occurrence + 1
+        return f"{digest}:{occurrence}"
+
+    def get(self, key: str):
+        record = self.store.get(self.pass_key, key)
+        if record is not None:
+            with self._lock:
+                self.replayed += 1
+        return record
+
+    def put(self, key: str, stage: str, **data):
+        self.store.put(self.task_id, self.pass_key, key, stage, data)
+
+
+class CheckpointStore(object):
+    """
+    Append-only JSONL store of the stage outputs of unfinished passes
+    (retrieval responses, plans and their verification, code revisions and
+    their sample-IO logs). Records of released passes stay in the file
+    until they outnumber both the live records and `compact_min_records`;
+    the file is then rewritten with the live records only.
+
+    Arguments
+    ---------
+    path : str
+        Checkpoint file; created if missing
+    completed_ids : set
+        Task ids already present in the results, e.g.
+        `Results.completed_ids`. Their checkpoints are dropped from the
+        file when it is opened.
+    flush_interval : int
+        Number of records buffered between flush + fsync calls
+    compact_min_records : int
+        Dead records tolerated in the file before it is compacted
+    """
+
+    def __init__(
+        self,
+        path: str,
+        completed_ids: set = None,
+        flush_interval: int = 1,
+        compact_min_records: int = 1000,
+    ):
+        self.path = path
+        self.flush_interval = max(1, flush_interval)
+        self.compact_min_records = compact_min_records
+        self.compactions = 0
+        self._passes = {}
+        self._pending = 0
+        self._lines = 0             # records in the file
+        self._live = 0              # of which belong to unreleased passes
+        self._lock = threading.Lock()
+
+        self._load(completed_ids or set())
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def start(self, task_id, pass_no: int) -> PassCheckpoint:
+        return PassCheckpoint(self, task_id, pass_no)
+
+    def _load(self, completed_ids: set):
+        if not os.path.exists(self.path):
+            return
+
+        kept = []
+        dropped = 0
+        with open(self.path, "rb") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of an interrupted write
+                    dropped += 1
+                    continue
+                if record["task_id"] in completed_ids:
+                    dropped += 1
+                    continue
+                self._passes.setdefault(record["pass"], {})[record["key"]] = record
+                kept.append(line if line.endswith(b"\n") else line + b"\n")
+
+        self._lines = self._live = len(kept)
+        if dropped:
+            self._rewrite(kept)
+
+    def _rewrite(self, lines: list):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.writelines(lines)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._passes)
+
+    def get(self, pass_key: str, key: str):
+        with self._lock:
+            return self._passes.get(pass_key, {}).get(key)
+
+    def put(self, task_id, pass_key: str, key: str, stage: str, data: dict):
+        record = {"task_id": task_id, "pass": pass_key, "key": key, "stage": stage, **data}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._passes.setdefault(pass_key, {})[key] = record
+            self._fp.write(line)
+            self._lines += 1
+            self._live += 1
+            self._pending += 1
+            if self._pending >= self.flush_interval:
+                self._flush()
+
+    def release(self, pass_key: str):
+        """Frees a finished pass; its records are dropped at the next compaction"""
+        with self._lock:
+            released = self._passes.pop(pass_key, None)
+            if released is None:
+                return
+            self._live -= len(released)
+            dead = self._lines - self._live
+            if self._fp is not None and dead >= max(self.compact_min_records, self._live):
+                self._compact()
+
+    def _compact(self):
+        self._flush()
+        self._fp.close()
+        lines = [
+            (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            for records in self._passes.values()
+            for record in records.values()
+        ]
+        self._rewrite(lines)
+        self._fp = open(self.path, "a", encoding="utf-8")
+        self._lines = self._live = len(lines)
+        self.compactions += 1
+
+    def _flush(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._flush()
+                self._fp.close()
+                self._fp = None
@@ -1,4 +1,5 @@
 import os
+import json
 
 from utils.jsonl import read_jsonl, write_jsonl
 
@@ -6,30 +7,162 @@ from utils.jsonl import read_jsonl, write_jsonl
 
 class Results(object):
     def __init__(
-        self, 
-        result_path: str, 
-        discard_previous_run: bool = False
+        self,
+        result_path: str,
+        discard_previous_run: bool = False,
+        append_only: bool = False,
+        flush_interval: int = 1,
+        id_key: str = "task_id",
     ):
+        """
+        Arguments
+        ---------
+        append_only : bool
+            Write one JSON line per result instead of rewriting the whole
+            file on every `add_result`. A torn last line (e.g. after a crash)
+            is ignored on the next load.
+        flush_interval : int
+            In append-only mode, number of results buffered between
+            flush + fsync calls.
+        id_key : str
+            Item field used to identify a task for resume and compaction.
+        """
         self.result_path = result_path
         self.discard_previous_run = discard_previous_run
+        self.append_only = append_only
+        self.flush_interval = max(1, flush_interval)
+        self.id_key = id_key
+
+        self._fp = None
+        self._pending = 0
+        self._completed_ids = None
         self.load_results()
 
     def add_result(self, result: dict):
         self.results.append(result)
-        self.save_results()
+        if self._completed_ids is not None and self.id_key in result:
+            self._completed_ids.add(result[self.id_key])
+
+        if self.append_only:
+            self._append(result)
+        else:
+            self.save_results()
 
     def save_results(self):
-        write_jsonl(self.result_path, self.results)
+        if self.append_only:
+            self.flush()
+        else:
+            write_jsonl(self.result_path, self.results)
 
     def load_results(self):
         if os.path.exists(self.result_path):
             if self.discard_previous_run:
                 os.remove(self.result_path)
+                self.results = []
+            elif self.append_only:
+                self.results = self._read_log()
             else:
                 self.results = read_jsonl(self.result_path)
         else:
             self.results = []
 
+    def _read_log(self):
+        results = []
+        with open(self.result_path, "rb") as fp:
+            data = fp.read()
+
+        torn = False
+        lines = data.split(b"\n")
+        for line_no, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Only the final line can be torn by a crash mid-write
+                if line_no == len(lines) - 1:
+                    torn = True
+                    break
+                raise
+
+        if torn:
+            # Drop the torn tail so the next append starts on a clean line
+            with open(self.result_path, "r+b") as fp:
+                fp.truncate(data.rfind(b"\n") + 1)
+        elif data and not data.endswith(b"\n"):
+            # A complete last line only lacks its newline
+            with open(self.result_path, "ab") as fp:
+                fp.write(b"\n")
+
+        return results
+
+    def _append(self, result: dict):
+        if self._fp is None:
+            self._fp = open(self.result_path, "a", encoding="utf-8")
+
+        self._fp.write(json.dumps(result) + "\n")
+        self._pending += 1
+        if self._pending >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._fp is None or self._pending == 0:
+            return
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._pending = 0
+
+    def close(self):
+        if self._fp is not None:
+            self.flush()
+            self._fp.close()
+            self._fp = None
+
+    @property
+    def completed_ids(self) -> set:
+        """Ids of all tasks present in the log, built on first access."""
+        if self._completed_ids is None:
+            self._completed_ids = {
+                result[self.id_key]
+                for result in self.results
+                if self.id_key in result
+            }
+        return self._completed_ids
+
+    def is_completed(self, task_id) -> bool:
+        return task_id in self.completed_ids
+
+    def compact(self):
+        """
+        Rewrites the log keeping only the latest result of every task, in
+        the order the tasks first appeared. The rewrite goes through a
+        temporary file so a crash leaves either the old or the new log.
+        """
+        self.close()
+
+        position = {}
+        compacted = []
+        for result in self.results:
+            task_id = result.get(self.id_key)
+            if task_id is None:
+                compacted.append(result)
+            elif task_id in position:
+                compacted[position[task_id]] = result
+            else:
+                position[task_id] = len(compacted)
+                compacted.append(result)
+
+        tmp_path = self.result_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            for result in compacted:
+                fp.write(json.dumps(result) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.result_path)
+
+        self.results = compacted
+        return len(compacted)
+
     def get_results(self):
         return self.results
 
@@ -38,3 +171,9 @@ class Results(object):
 
     def __getitem__(self, idx):
         return self.results[idx]
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
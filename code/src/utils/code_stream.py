@@ -0,0 +1,85 @@
+FENCE = "```"
+
+
+class CodeStreamExtractor(object):
+    """
+    Follows a streamed completion and finds its first fenced code block as
+    the text arrives, so the stream can be closed as soon as the block is
+    complete instead of paying for the chatter after it.
+
+    `feed` returns True once the stream should stop: the closing fence
+    arrived ("fence_closed"), the text grew past `max_chars`
+    ("max_chars"), or no fence opened within `max_preamble_chars`
+    ("no_code"). `reason` tells which.
+    """
+
+    def __init__(self, max_chars: int = None, max_preamble_chars: int = None):
+        self.max_chars = max_chars
+        self.max_preamble_chars = max_preamble_chars
+        self.reason = None
+
+        self._parts = []
+        self._tail = ""             # unscanned end of the text seen so far
+        self._length = 0
+        self._scanned = 0           # absolute offset where `_tail` starts
+        self._code_start = None     # offset after the opening fence line
+        self._code_end = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def code(self) -> str:
+        """Code of the first block, possibly still incomplete"""
+        if self._code_start is None:
+            return ""
+        return self.text[self._code_start:self._code_end]
+
+    def feed(self, delta: str) -> bool:
+        if self.reason is not None:
+            return True
+
+        self._parts.append(delta)
+        self._length += len(delta)
+        self._tail += delta
+
+        while self._code_end is None:
+            if self._code_start is None:
+                # Opening fence: "```" plus the rest of its line (language tag)
+                fence = self._tail.find(FENCE)
+                if fence < 0:
+                    break
+                newline = self._tail.find("\n", fence + len(FENCE))
+                if newline < 0:
+                    break
+                self._code_start = self._scanned + newline + 1
+                self._advance(newline + 1)
+            else:
+                fence = self._tail.find(FENCE)
+                if fence < 0:
+                    break
+                self._code_end = self._scanned + fence
+                self.reason = "fence_closed"
+                return True
+
+        if self._code_start is None and self._code_end is None:
+            # Keep a possibly split fence for the next delta
+            keep = self._tail.rfind(FENCE)
+            self._advance(keep if keep >= 0 else max(0, len(self._tail) - len(FENCE) + 1))
+        elif self._code_end is None:
+            self._advance(max(0, len(self._tail) - len(FENCE) + 1))
+
+        if self.max_chars is not None and self._length >= self.max_chars:
+            self.reason = "max_chars"
+        elif (
+            self.max_preamble_chars is not None
+            and self._code_start is None
+            and self._length >= self.max_preamble_chars
+        ):
+            self.reason = "no_code"
+        return self.reason is not None
+
+    def _advance(self, count: int):
+        self._tail = self._tail[count:]
+        self._scanned += count
@@ -0,0 +1,117 @@
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+
+
+# Correlation id of the item being processed in the current thread / task.
+# Worker threads inherit it when submitted through `contextvars.copy_context`.
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# Marks the end of the queue for the writer thread
+_STOP = object()
+
+_encode = json.JSONEncoder(ensure_ascii=False, default=str).encode
+
+
+class EventLogger(object):
+    """
+    Leveled, structured event logger for the prompting strategies.
+
+    An event is a plain dict handed to a queue; a background writer thread
+    serializes the queued events as JSON lines and writes them in batches,
+    so the calling worker neither formats nor blocks on the sink. Levels
+    are the `logging` ones, but no `logging.LogRecord` is built: prompt and
+    response events are far too frequent for it. Every event carries the
+    correlation id of the current item. Full prompt and response bodies
+    are only written when `log_prompts` is set; otherwise text events
+    record the body size.
+
+    Arguments
+    ---------
+    path : str
+        JSONL file to append events to; stdout when omitted
+    level : int
+        Minimum `logging` level that is emitted
+    log_prompts : bool
+        Include full prompt/response bodies in text events
+    flush_interval : float
+        Seconds the writer collects events before writing them out
+    """
+
+    def __init__(self, path: str = None, level: int = logging.INFO, log_prompts: bool = False, flush_interval: float = 0.05):
+        self.level = level
+        self.log_prompts = log_prompts
+        self.flush_interval = flush_interval
+
+        if path is None:
+            self._sink = sys.stdout
+            self._owns_sink = False
+        else:
+            self._sink = open(path, "a", encoding="utf-8")
+            self._owns_sink = True
+
+        self._queue = queue.SimpleQueue()
+        self._closing = threading.Event()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def event(self, name: str, level: int = logging.INFO, **fields):
+        if level < self.level:
+            return
+        event = {"ts": round(time.time(), 6), "level": logging.getLevelName(level), "event": name}
+        cid = correlation_id.get()
+        if cid is not None:
+            event["cid"] = cid
+        event.update(fields)
+        self._queue.put(event)
+
+    def text(self, name: str, body: str, level: int = logging.DEBUG, **fields):
+        """Logs a prompt or response; the body itself only if `log_prompts`"""
+        if level < self.level:
+            return
+        fields["chars"] = len(body)
+        if self.log_prompts:
+            fields["body"] = body
+        self.event(name, level, **fields)
+
+    def _write(self):
+        while True:
+            events = [self._queue.get()]
+            if events[0] is not _STOP:
+                # Let a batch build up rather than waking on every event
+                self._closing.wait(self.flush_interval)
+            # Everything queued meanwhile goes out in the same write
+            while events[-1] is not _STOP:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = events[-1] is _STOP
+            if stop:
+                events.pop()
+            if events:
+                self._sink.write("".join(_encode(event) + "\n" for event in events))
+                self._sink.flush()
+            if stop:
+                return
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._closing.set()
+            self._writer.join()
+            self._writer = None
+            atexit.unregister(self.close)
+            # Later events are dropped instead of piling up in the queue
+            self.level = logging.CRITICAL + 1
+            if self._owns_sink:
+                self._sink.close()
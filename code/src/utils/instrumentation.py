@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from utils.event_log import correlation_id
+
+
+# Numeric span attributes summed per stage in summaries and exports
+METRICS = (
+    "wall_time",
+    "cpu_time",
+    "queue_wait",
+    "prompt_tokens",
+    "cached_prompt_tokens",
+    "completion_tokens",
+    "retries",
+)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span(object):
+    __slots__ = ("name", "cid", "span_id", "parent_id", "start", "end", "cpu_start", "attributes")
+
+    def __init__(self, name: str, cid, parent_id, attributes: dict):
+        self.name = name
+        self.cid = cid
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end = None
+        # CPU time of the thread the span runs on, excluding worker threads
+        self.cpu_start = time.thread_time()
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Instrumentation(object):
+    """
+    Pluggable instrumentation hook for the prompting strategies.
+
+    The strategy wraps every stage and every model / sample-IO call in
+    `span(...)`; spans finish through `on_span_end`. This base class only
+    keeps the span tree consistent and records nothing, so it is free to
+    leave in place. See `SpanRecorder` for a collecting implementation.
+    """
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        span = Span(name, correlation_id.get(), parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+            span.attributes["wall_time"] = span.end - span.start
+            span.attributes["cpu_time"] = time.thread_time() - span.cpu_start
+            _current_span.reset(token)
+            self.on_span_end(span)
+
+    def on_span_end(self, span: Span):
+        pass
+
+    def pop_summary(self, cid):
+        return None
+
+
+class SpanRecorder(Instrumentation):
+    """
+    Aggregates spans per item (correlation id) and per stage.
+
+    `pop_summary(cid)` returns and forgets the per-stage totals of one
+    item, ready to be stored with its result. Run-wide totals are kept for
+    `to_prometheus`, and when `otel_path` is given every span is appended
+    to it as an OTLP/JSON `resourceSpans` line.
+    """
+
+    def __init__(self, otel_path: str = None, service_name: str = "blueprint2code"):
+        self.otel_path = otel_path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        self._items = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._otel_fp = open(otel_path, "a", encoding="utf-8") if otel_path else None
+
+    def on_span_end(self, span: Span):
+        with self._lock:
+            for stats in (self._items[span.cid][span.name], self._totals[span.name]):
+                stats["count"] += 1
+                for metric in METRICS:
+                    value = span.attributes.get(metric)
+                    if isinstance(value, (int, float)):
+                        stats[metric] += value
+
+            if self._otel_fp is not None:
+                self._otel_fp.write(json.dumps(self._to_otlp(span)) + "\n")
+
+    def pop_summary(self, cid) -> dict:
+        with self._lock:
+            stages = self._items.pop(cid, {})
+            return {
+                name: {
+                    key: int(value) if float(value).is_integer() else round(value, 6)
+                    for key, value in stats.items()
+                }
+                for name, stats in stages.items()
+            }
+
+    def totals(self) -> dict:
+        """Run-wide totals per span name, as in `pop_summary`"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._totals.items()}
+
+    def _to_otlp(self, span: Span) -> dict:
+        trace_id = hashlib.md5(str(span.cid).encode("utf-8")).hexdigest()
+        attributes = []
+        for key, value in span.attributes.items():
+            if isinstance(value, bool):
+                attributes.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                attributes.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                attributes.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                attributes.append({"key": key, "value": {"stringValue": str(value)}})
+        attributes.append({"key": "cid", "value": {"stringValue": str(span.cid)}})
+
+        otlp_span = {
+            "traceId": trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start * 1e9)),
+            "endTimeUnixNano": str(int(span.end * 1e9)),
+            "attributes": attributes,
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{"scope": {"name": "blueprint2code"}, "spans": [otlp_span]}],
+            }]
+        }
+
+    def to_prometheus(self) -> str:
+        """Run-wide per-stage totals in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            names = sorted(self._totals)
+            lines.append("# TYPE blueprint2code_span_count counter")
+            for name in names:
+                lines.append(f'blueprint2code_span_count{{span="{name}"}} {int(self._totals[name]["count"])}')
+            for metric in METRICS:
+                lines.append(f"# TYPE blueprint2code_{metric}_total counter")
+                for name in names:
+                    lines.append(f'blueprint2code_{metric}_total{{span="{name}"}} {self._totals[name][metric]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            fp.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if self._otel_fp is not None:
+            self._otel_fp.close()
+            self._otel_fp = None
@@ -0,0 +1,102 @@
+import re
+
+
+# Tags that hold free text and may only appear inside a <problem>
+PROBLEM_FIELDS = ("description", "code", "techniques", "planning")
+
+# Tags that hold free text directly under the root
+ROOT_FIELDS = ("algorithm", "learned_techniques", "analysis", "confidence")
+
+FIELDS = frozenset(PROBLEM_FIELDS + ROOT_FIELDS)
+
+_TAG = re.compile(
+    r"<(/?)(root|problem|" + "|".join(PROBLEM_FIELDS + ROOT_FIELDS) + r")\s*>"
+)
+
+
+def _clean(text: str) -> str:
+    if "<![CDATA[" in text:
+        text = text.replace("<![CDATA[", "").replace("]]>", "")
+    if "```" in text:
+        text = text.replace("```xml", "").replace("```", "")
+    return text
+
+
+def _add(result: dict, key: str, value):
+    if key not in result:
+        result[key] = value
+    elif isinstance(result[key], list):
+        result[key].append(value)
+    else:
+        result[key] = [result[key], value]
+
+
+def parse_tags(response: str) -> dict:
+    """
+    Extracts the known tags of Blueprint2Code responses in one scan.
+
+    Only the schema tags (root, problem and the fields above) are
+    recognised; anything else, including stray `<` and CDATA markers, is
+    text. Field tags left unclosed end at the next schema tag or at the end
+    of the response, and an unclosed <problem> ends where a root field or
+    the next <problem> starts, so the parse never fails. The result has the
+    shape of the former ElementTree based parse: fields map to their text,
+    repeated tags become lists and every problem is a dict of its fields.
+    """
+    result = {}
+    problem = None          # fields of the open <problem>
+    problem_start = 0       # where the open <problem>'s text starts
+    field = None            # name of the open field tag
+    field_start = 0         # where the open field's text starts
+
+    def close_field(end):
+        nonlocal field
+        target = problem if problem is not None and field in PROBLEM_FIELDS else result
+        _add(target, field, _clean(response[field_start:end]))
+        field = None
+
+    def close_problem(end):
+        nonlocal problem
+        if not problem:
+            # <problem> with bare text and no field tags
+            problem["description"] = _clean(response[problem_start:end])
+        _add(result, "problem", problem)
+        problem = None
+
+    for match in _TAG.finditer(response):
+        closing, tag = match.group(1), match.group(2)
+
+        if field is not None:
+            if closing and tag != field and tag in FIELDS:
+                # Closing tag of another field inside this one is plain text
+                continue
+            close_field(match.start())
+            if closing and tag in FIELDS:
+                continue
+
+        if tag == "root":
+            continue
+
+        if tag == "problem":
+            if problem is not None:
+                close_problem(match.start())
+            if not closing:
+                problem = {}
+                problem_start = match.end()
+            continue
+
+        if closing:
+            continue
+
+        if tag in ROOT_FIELDS and problem is not None:
+            close_problem(match.start())
+
+        field = tag
+        field_start = match.end()
+
+    if field is not None:
+        close_field(len(response))
+    if problem is not None:
+        close_problem(len(response))
+
+    return result
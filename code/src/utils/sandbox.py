@@ -0,0 +1,242 @@
+import os
+import sys
+import math
+import time
+import signal
+import resource
+import selectors
+import threading
+import traceback
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+PYTHON_LANGUAGES = {"python", "python3", "py", "pypy", "pypy3"}
+
+# Candidate output beyond this is dropped; sample outputs are small
+MAX_OUTPUT_BYTES = 1 << 20
+
+
+def _apply_limits(time_limit: float, memory_limit_mb: int):
+    cpu = math.ceil(time_limit) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    if memory_limit_mb:
+        memory = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def _exec_in_child(program: str):
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+
+    status = 0
+    try:
+        exec(compile(program, "<candidate>", "exec"), {"__name__": "__main__"})
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(status)
+
+
+def run_case(program: str, stdin: str, time_limit: float, memory_limit_mb: int) -> dict:
+    """
+    Runs a Python program on `stdin` in a child forked from the calling
+    (already warm) worker process, under CPU, memory and wall-clock limits.
+    """
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(in_w)
+            os.close(out_r)
+            os.close(err_r)
+            os.dup2(in_r, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os.setsid()
+            _apply_limits(time_limit, memory_limit_mb)
+        except BaseException:
+            os._exit(1)
+        _exec_in_child(program)
+
+    os.close(in_r)
+    os.close(out_w)
+    os.close(err_w)
+
+    def feed():
+        try:
+            with os.fdopen(in_w, "wb") as fp:
+                fp.write(stdin.encode("utf-8"))
+        except (BrokenPipeError, OSError):
+            pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+
+    outputs = {out_r: bytearray(), err_r: bytearray()}
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ)
+    selector.register(err_r, selectors.EVENT_READ)
+
+    deadline = time.monotonic() + time_limit
+    timed_out = False
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        for key, _ in selector.select(remaining):
+            chunk = os.read(key.fd, 65536)
+            if not chunk:
+                selector.unregister(key.fd)
+            elif len(outputs[key.fd]) < MAX_OUTPUT_BYTES:
+                outputs[key.fd] += chunk
+
+    if timed_out:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    _, wait_status = os.waitpid(pid, 0)
+
+    selector.close()
+    os.close(out_r)
+    os.close(err_r)
+    writer.join()
+
+    if timed_out:
+        status = "timeout"
+    elif os.WIFSIGNALED(wait_status):
+        status = "timeout" if os.WTERMSIG(wait_status) == signal.SIGXCPU else "runtime_error"
+    elif os.WEXITSTATUS(wait_status) != 0:
+        status = "runtime_error"
+    else:
+        status = "ok"
+
+    return {
+        "status": status,
+        "stdout": outputs[out_r].decode("utf-8", errors="replace"),
+        "stderr": outputs[err_r].decode("utf-8", errors="replace"),
+    }
+
+
+def _normalize_output(output: str) -> str:
+    return "\n".join(line.rstrip() for line in output.strip().splitlines())
+
+
+class SandboxPool(object):
+    """
+    Pool of pre-forked worker processes that evaluate a candidate on all of
+    an item's sample cases in parallel.
+
+    Every case runs in its own child of a warm worker with CPU, memory and
+    wall-clock limits, and evaluation stops at the first failing case.
+    `evaluate_sample_io` keeps the `(passed, test_log)` contract of
+    `Dataset.evaluate_sample_io`. Only Python candidates are supported;
+    callers fall back to the dataset for other languages (see `supports`).
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        time_limit: float = 5.0,
+        memory_limit_mb: int = 1024,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.time_limit = time_limit
+        self.memory_limit_mb = memory_limit_mb
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+        # Start every worker now instead of on the first evaluation
+        for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    @staticmethod
+    def supports(language: str) -> bool:
+        return language.lower() in PYTHON_LANGUAGES
+
+    def _case_job(self, code: str, io):
+        if isinstance(io, dict):
+            return code, io["input"]
+        # Function-style samples are assert statements appended to the code
+        prefix = "from typing import *\n" if "from typing import *" not in code else ""
+        return prefix + code + "\n" + io + "\n", ""
+
+    @staticmethod
+    def _case_log(io, result) -> tuple:
+        if isinstance(io, dict):
+            expected = io["output"][0] if isinstance(io["output"], list) else io["output"]
+            passed = (
+                result["status"] == "ok"
+                and _normalize_output(result["stdout"]) == _normalize_output(expected)
+            )
+            if passed:
+                return True, f"passed in test case: {io['input']}\n"
+            if result["status"] == "ok":
+                received = result["stdout"]
+            else:
+                received = result["status"] + (f"\n{result['stderr'].strip()}" if result["stderr"].strip() else "")
+            return False, f"failed in test case: {io['input']}\nexpected output: {expected}\nyour output: {received}\n"
+
+        if result["status"] == "ok":
+            return True, f"passed in test case: {io}\n"
+        return False, f"failed in test case: {io}\n"
+
+    def evaluate_sample_io(self, item: dict, code: str, language: str = "Python3"):
+        sample_io = item.get("sample_io", [])
+        if len(sample_io) == 0:
+            return True, ""
+
+        futures = {}
+        for index, io in enumerate(sample_io):
+            program, stdin = self._case_job(code, io)
+            future = self._executor.submit(
+                run_case, program, stdin, self.time_limit, self.memory_limit_mb
+            )
+            futures[future] = index
+
+        logs = {}
+        first_failure = None
+        pending = set(futures)
+        while pending and first_failure is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                passed, log = self._case_log(sample_io[index], future.result())
+                logs[index] = log
+                if not passed and (first_failure is None or index < first_failure):
+                    first_failure = index
+
+        # Early exit: cases not started yet are dropped
+        for future in pending:
+            future.cancel()
+
+        test_log = "".join(logs[index] for index in sorted(logs))
+        return first_failure is None, test_log
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubChatServer(object):
+    """
+    Minimal local server speaking the OpenAI chat completions protocol, for
+    exercising and benchmarking the model layer offline.
+
+    `reply` is either a fixed string or a callable receiving the request
+    body and returning the completion text. `latency` seconds are slept
+    before every answer. Requests with `stream=True` are answered as
+    server-sent events of `chunk_size` characters, `chunk_latency`
+    seconds apart.
+
+    Usage
+    -----
+    with StubChatServer(reply="print(1)", latency=0.05) as server:
+        model = ChatGPT(api_base=server.base_url)
+    """
+
+    def __init__(
+        self,
+        reply="",
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        chunk_size: int = 16,
+        chunk_latency: float = 0.0,
+    ):
+        self.reply = reply
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.chunks_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections alive between requests
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if body.get("stream"):
+                    return self.stream(stub.completion(body))
+                payload = json.dumps(stub.completion(body)).encode("utf-8")
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, completion: dict):
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                content = completion["choices"][0]["message"]["content"]
+                base = {k: completion[k] for k in ("id", "created", "model")}
+                base["object"] = "chat.completion.chunk"
+                events = [
+                    {**base, "choices": [{"index": 0, "delta": {"content": content[i:i + stub.chunk_size]}, "finish_reason": None}]}
+                    for i in range(0, len(content), stub.chunk_size)
+                ]
+                events.append({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                events.append({**base, "choices": [], "usage": completion["usage"]})
+                try:
+                    for event in events:
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        with stub._lock:
+                            stub.chunks_sent += 1
+                        if stub.chunk_latency:
+                            time.sleep(stub.chunk_latency)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream early
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def completion(self, body: dict) -> dict:
+        with self._lock:
+            self.requests += 1
+            request_no = self.requests
+
+        # One completion per requested choice (`n`), sharing the prompt
+        contents = [
+            self.reply(body) if callable(self.reply) else self.reply
+            for _ in range(body.get("n") or 1)
+        ]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        completion_tokens = sum(len(content.split()) for content in contents)
+
+        return {
+            "id": f"chatcmpl-stub-{request_no}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": index,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+                for index, content in enumerate(contents)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
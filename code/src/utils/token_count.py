@@ -1,19 +1,129 @@
+import re
+import threading
+from collections import OrderedDict
+
 import tiktoken
 
 
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+# Used for models tiktoken does not know about
+FALLBACK_ENCODING = "cl100k_base"
+
+# Problem statements, tutorials and sample IO reappear in every stage prompt
+# of an item inside different messages, so message contents are counted
+# paragraph by paragraph and counts are memoized per (encoding, paragraph).
+# tiktoken's pre-tokenizer never merges across a run of newlines followed by
+# text, so the sum equals the count of the whole content.
+MAX_CACHED_STRINGS = 4096
+PARAGRAPH_BREAK = re.compile(r"(?<=\n\n)(?=\S)")
+
+_encodings = {}
+_counts = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_encoding(model="gpt-3.5-turbo"):
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+        _encodings[model] = encoding
+    return encoding
+
+
+def _cached_count(key):
+    with _lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+        return count
+
+
+def _store_count(key, count):
+    with _lock:
+        _counts[key] = count
+        _counts.move_to_end(key)
+        while len(_counts) > MAX_CACHED_STRINGS:
+            _counts.popitem(last=False)
+
+
+def string_token_count(text, model="gpt-3.5-turbo"):
+    encoding = get_encoding(model)
+    key = (encoding.name, text)
+    count = _cached_count(key)
+    if count is None:
+        count = len(encoding.encode(text, disallowed_special=()))
+        _store_count(key, count)
+    return count
+
 
-def token_count(messages, model="gpt-3.5-turbo"):  
-    encoding = tiktoken.encoding_for_model('gpt-3.5-turbo')
+def truncate_to_tokens(text, max_tokens, model="gpt-3.5-turbo", marker="\n... (truncated)"):
+    """Cuts `text` to its first `max_tokens` tokens, marking the cut"""
+    if max_tokens <= 0:
+        return ""
+    if string_token_count(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens]) + marker
 
-    tokens_per_message = 4
-    tokens_per_name = 1
 
+def paragraphs(text):
+    return PARAGRAPH_BREAK.split(text)
+
+
+def content_token_count(text, model="gpt-3.5-turbo"):
+    return sum(string_token_count(paragraph, model) for paragraph in paragraphs(text))
+
+
+def _messages_count(messages, counts):
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
+        num_tokens += TOKENS_PER_MESSAGE
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += counts(value)
             if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3
+                num_tokens += TOKENS_PER_NAME
+    num_tokens += TOKENS_PER_REPLY
     return num_tokens
+
+
+def token_count(messages, model="gpt-3.5-turbo"):
+    return _messages_count(messages, lambda value: content_token_count(value, model))
+
+
+def token_count_batch(messages_list, model="gpt-3.5-turbo", num_threads=8):
+    """
+    Counts the tokens of many message lists at once. Paragraphs not yet in
+    the memo are encoded together with tiktoken's batch encoder.
+    """
+    encoding = get_encoding(model)
+
+    counts = {}
+    missing = []
+    for messages in messages_list:
+        for message in messages:
+            for value in message.values():
+                for paragraph in paragraphs(value):
+                    if paragraph in counts:
+                        continue
+                    count = _cached_count((encoding.name, paragraph))
+                    counts[paragraph] = count
+                    if count is None:
+                        missing.append(paragraph)
+
+    if missing:
+        encoded = encoding.encode_batch(missing, num_threads=num_threads, disallowed_special=())
+        for value, tokens in zip(missing, encoded):
+            counts[value] = len(tokens)
+            _store_count((encoding.name, value), len(tokens))
+
+    def content_count(value):
+        return sum(counts[paragraph] for paragraph in paragraphs(value))
+
+    return [_messages_count(messages, content_count) for messages in messages_list]